@@ -1,24 +1,86 @@
-from django.core.mail import send_mail
+from multiprocessing.pool import ThreadPool
+
+from django.core.mail import EmailMessage, get_connection
 from django.contrib.sites.models import Site
 from django.template.loader import render_to_string
 
 import settings
 
 
+# Stands in for the activation key when rendering templates once for
+# many surveys; keys are hex digests, so plain substitution is safe
+KEY_PLACEHOLDER = '__ACTIVATION_KEY__'
+
+
+class ActivationEmailTemplate(object):
+    """
+    Activation email rendered once and filled in per survey.
+    """
+
+    def __init__(self, site=None):
+
+        # Build email context
+        mail_context = {
+            'activation_key': KEY_PLACEHOLDER,
+            'site': site or Site.objects.get_current(),
+        }
+
+        # Build email subject
+        subject = render_to_string('activation_email_subject.txt', mail_context)
+        self.subject = ''.join(subject.splitlines())
+
+        # Build email message
+        self.message = render_to_string('activation_email.txt', mail_context)
+
+    def build(self, survey, connection=None):
+
+        return EmailMessage(
+            self.subject.replace(KEY_PLACEHOLDER, survey.activation_key),
+            self.message.replace(KEY_PLACEHOLDER, survey.activation_key),
+            settings.DEFAULT_FROM_EMAIL,
+            [survey.email],
+            connection=connection,
+        )
+
+
 def send_activation_email(survey):
 
-    # Build email context
-    mail_context = {
-        'activation_key': survey.activation_key,
-        'site': Site.objects.get_current(),
-    }
+    ActivationEmailTemplate().build(survey).send()
+
+
+def queue_activation_email(survey):
+
+    # Imported here since models imports this module
+    from models import QueuedEmail
+    QueuedEmail.objects.enqueue(ActivationEmailTemplate().build(survey))
+
+
+def _send_chunk(messages):
+
+    # One backend connection for the whole chunk
+    connection = get_connection()
+    return connection.send_messages(messages) or 0
+
+
+def send_activation_emails(surveys, chunk_size=50, workers=4):
+    """ Send activation emails for `surveys` in chunks of `chunk_size`
+    over a pool of `workers` threads. Yields each chunk's surveys once
+    its messages have been handed to the mail backend. """
 
-    # Build email subject
-    subject = render_to_string('activation_email_subject.txt', mail_context)
-    subject = ''.join(subject.splitlines())
+    template = ActivationEmailTemplate()
+    surveys = list(surveys)
+    chunks = [
+        surveys[idx:idx + chunk_size]
+        for idx in range(0, len(surveys), chunk_size)
+    ]
 
-    # Build email message
-    message = render_to_string('activation_email.txt', mail_context)
+    def send(chunk):
+        _send_chunk([template.build(survey) for survey in chunk])
+        return chunk
 
-    # Send email
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [survey.email])
+    pool = ThreadPool(workers)
+    try:
+        for chunk in pool.imap_unordered(send, chunks):
+            yield chunk
+    finally:
+        pool.terminate()
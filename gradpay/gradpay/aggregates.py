@@ -1,21 +1,183 @@
 '''
-Add MEDIAN aggregate. Code adapted from http://coder.cl/2011/09/custom-aggregates-on-django/
+Percentile aggregates (MEDIAN and friends). Code adapted from http://coder.cl/2011/09/custom-aggregates-on-django/
+
+PostgreSQL and Oracle compute these with the ordered-set aggregate
+PERCENTILE_CONT. SQLite has no equivalent, so a PERCENTILE(value, fraction)
+function with the same interpolation is registered on each new connection.
 '''
 
+import json
+import math
+import collections
+
 from django.db import models
+from django.db.backends.signals import connection_created
+
+
+def interpolate(values, fraction):
+    """ Value at ``fraction`` of the way through sorted ``values``,
+    interpolating linearly between ranks as PERCENTILE_CONT does. """
+
+    if not values:
+        return None
+    rank = fraction * (len(values) - 1)
+    lo = int(math.floor(rank))
+    hi = int(math.ceil(rank))
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+
+class SQLitePercentile(object):
+
+    def __init__(self):
+        self.values = []
+        self.fraction = None
+
+    def step(self, value, fraction):
+        if value is not None:
+            self.values.append(value)
+        self.fraction = fraction
+
+    def finalize(self):
+        self.values.sort()
+        return interpolate(self.values, self.fraction)
+
+
+def register_sqlite_functions(sender, connection, **kwargs):
+
+    if connection.vendor == 'sqlite':
+        connection.connection.create_aggregate('PERCENTILE', 2, SQLitePercentile)
+
+connection_created.connect(register_sqlite_functions)
+
+
+class PercentileSQL(models.sql.aggregates.Aggregate):
+
+    is_computed = True
+
+    sql_templates = {
+        'postgresql': 'PERCENTILE_CONT(%(fraction)s) WITHIN GROUP (ORDER BY %(field)s)',
+        'oracle': 'PERCENTILE_CONT(%(fraction)s) WITHIN GROUP (ORDER BY %(field)s)',
+        'sqlite': 'PERCENTILE(%(field)s, %(fraction)s)',
+    }
+
+    def as_sql(self, qn, connection):
+
+        try:
+            template = self.sql_templates[connection.vendor]
+        except KeyError:
+            raise NotImplementedError(
+                'Percentiles are not supported on %s' % connection.vendor
+            )
+
+        if hasattr(self.col, 'as_sql'):
+            field_name = self.col.as_sql(qn, connection)
+        elif isinstance(self.col, (list, tuple)):
+            field_name = '.'.join([qn(c) for c in self.col])
+        else:
+            field_name = self.col
 
+        return template % {
+            'field': field_name,
+            'fraction': float(self.extra['fraction']),
+        }
 
-class MedianSQL(models.sql.aggregates.Aggregate):
-    sql_function = 'MEDIAN'
 
+class Percentile(models.Aggregate):
+    name = 'Percentile'
 
-class Median(models.Aggregate):
-    name = 'Median'
+    def __init__(self, lookup, fraction, **extra):
+        super(Percentile, self).__init__(lookup, fraction=fraction, **extra)
 
     def add_to_query(self, query, alias, col, source, is_summary):
-        query.aggregates[alias] = MedianSQL(
+        query.aggregates[alias] = PercentileSQL(
             col,
             source=source,
             is_summary=is_summary,
             **self.extra
         )
+
+
+class Median(Percentile):
+
+    def __init__(self, lookup, **extra):
+        super(Median, self).__init__(lookup, 0.5, **extra)
+
+
+# Relative error bound of QuantileSketch estimates
+SKETCH_ACCURACY = 0.01
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch for non-negative values, after DDSketch
+    (Masson et al., VLDB 2019). Values are counted in buckets whose
+    boundaries grow geometrically, so any quantile estimate is within
+    ``accuracy`` relative error of the exact value at that rank. Bucket
+    counts can be decremented, so values can be removed as well as added.
+    """
+
+    def __init__(self, counts=None, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.counts = collections.Counter(counts or {})
+
+    @classmethod
+    def loads(cls, data):
+        return cls(dict(
+            (int(key), count) for key, count in json.loads(data).iteritems()
+        ))
+
+    def dumps(self):
+        return json.dumps(dict(
+            (str(key), count) for key, count in self.counts.iteritems()
+        ))
+
+    def _key(self, value):
+        # Bucket 0 holds zeros; bucket k > 0 holds (gamma^(k-2), gamma^(k-1)]
+        if value < 1:
+            return 0
+        return int(math.ceil(math.log(value) / self.log_gamma)) + 1
+
+    def _value(self, key):
+        if key == 0:
+            return 0.0
+        return 2 * self.gamma ** (key - 1) / (self.gamma + 1)
+
+    def __len__(self):
+        return sum(self.counts.itervalues())
+
+    def add(self, value, count=1):
+        key = self._key(value)
+        self.counts[key] += count
+        if not self.counts[key]:
+            del self.counts[key]
+
+    def merge(self, other):
+        for key, count in other.counts.iteritems():
+            self.counts[key] += count
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def quantile(self, rank):
+        """ Estimate the value at 0-based ``rank`` in sorted order. """
+
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen > rank:
+                return self._value(key)
+        return None
+
+    def percentile(self, fraction):
+        """ Estimate a percentile, interpolating like PERCENTILE_CONT. """
+
+        total = len(self)
+        if not total:
+            return None
+        rank = fraction * (total - 1)
+        lo = self.quantile(int(math.floor(rank)))
+        hi = self.quantile(int(math.ceil(rank)))
+        return lo + (hi - lo) * (rank - math.floor(rank))
+
+    def median(self):
+        return self.percentile(0.5)
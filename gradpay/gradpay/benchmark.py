@@ -0,0 +1,183 @@
+'''
+Benchmark harness for the analytics views: drives each view through the
+test client and records latency percentiles, query counts and memory.
+'''
+
+import time
+import resource
+import datetime
+import platform
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.client import Client
+
+from aggregates import interpolate
+from models import Survey
+from synthetic import synthetic_surveys
+from views import SHA1_RE
+
+
+# Views as (name, path, query string)
+BENCHMARK_VIEWS = (
+    ('home', '/', {}),
+    ('results_json', '/results_json', {
+        'grouping_vars': 'institution',
+        'display_vars': 'stipend,teaching,loans_fmt',
+        'iSortingCols': '1', 'iSortCol_0': '1', 'sSortDir_0': 'desc',
+        'iDisplayStart': '0', 'iDisplayLength': '100', 'sEcho': '1',
+    }),
+    ('results_json_search', '/results_json', {
+        'grouping_vars': 'state,institution',
+        'display_vars': 'stipend',
+        'iSortingCols': '1', 'iSortCol_0': '0', 'sSortDir_0': 'asc',
+        'iDisplayStart': '0', 'iDisplayLength': '100', 'sEcho': '1',
+        'sSearch': 'university',
+    }),
+    ('scatter_json', '/scatter_json', {
+        'xv': 'stipend', 'yv': 'teaching_num', 'grouping_vars': 'institution',
+    }),
+    ('choro_json_state', '/choro_json', {'iv': 'state_code', 'dv': 'stipend'}),
+    ('choro_json_county', '/choro_json', {'iv': 'county_code', 'dv': 'stipend'}),
+    ('stipend_histogram', '/stipend_histogram/', {'bins': 'fd'}),
+    ('results_export', '/results_export/', {
+        'grouping_vars': 'department', 'display_vars': 'stipend,teaching',
+    }),
+    ('api_institution', '/api/institution/', {'limit': '1000'}),
+)
+
+# Name of the activation measurement, which activates a fresh synthetic
+# survey with each request rather than repeating one
+ACTIVATION = 'activate'
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def max_rss_kb():
+    """ Peak resident set size of this process so far. """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(client, path, params, repeat=20, cold=True):
+    """ Request `path` `repeat` times after one warm-up request. With
+    `cold`, the cache is cleared before each request so cached results
+    don't hide the work. """
+
+    latencies = []
+    queries = []
+    size = 0
+    rss_before = max_rss_kb()
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        for idx in range(repeat + 1):
+            if cold:
+                cache.clear()
+            start = time.time()
+            response = client.get(path, params)
+            body = ''.join(response)
+            elapsed = time.time() - start
+            if idx == 0:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(len(connection.queries))
+            size = len(body)
+            if response.status_code != 200:
+                raise RuntimeError('%s returned %d' % (path, response.status_code))
+    finally:
+        settings.DEBUG = debug
+
+    return summarize(latencies, queries, size, rss_before)
+
+
+def measure_activation(client, repeat=20):
+    """ Activate `repeat` inactive synthetic surveys, after one warm-up,
+    through the activation view. Each request uses up a survey; real
+    ones are never touched. """
+
+    keys = []
+    inactive = synthetic_surveys().filter(is_active=False).values_list('activation_key', flat=True)
+    for key in inactive.iterator():
+        if SHA1_RE.search(key):
+            keys.append(key)
+            if len(keys) > repeat:
+                break
+    if len(keys) < repeat + 1:
+        raise RuntimeError('Need %d inactive synthetic surveys to activate' % (repeat + 1))
+
+    latencies = []
+    queries = []
+    size = 0
+    rss_before = max_rss_kb()
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        for idx, key in enumerate(keys):
+            start = time.time()
+            response = client.get('/activate/%s/' % (key))
+            body = ''.join(response)
+            elapsed = time.time() - start
+            if idx > 0:
+                latencies.append(elapsed * 1000)
+                queries.append(len(connection.queries))
+                size = len(body)
+            if Survey.objects.filter(activation_key=key).exists():
+                raise RuntimeError('Survey with key %s was not activated' % (key))
+    finally:
+        settings.DEBUG = debug
+
+    return summarize(latencies, queries, size, rss_before)
+
+
+def summarize(latencies, queries, size, rss_before):
+
+    latencies.sort()
+    result = dict(
+        ('p%d_ms' % (fraction * 100), round(interpolate(latencies, fraction), 3))
+        for fraction in PERCENTILES
+    )
+    result.update({
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'queries': max(queries),
+        'bytes': size,
+        'peak_rss_kb': max_rss_kb(),
+        'rss_growth_kb': max_rss_kb() - rss_before,
+    })
+    return result
+
+
+def run_views(views=BENCHMARK_VIEWS, repeat=20, cold=True, progress=None,
+              activation=False):
+    """ Measure each view at the current table size, and activation
+    too with `activation`. """
+
+    client = Client()
+    surveys = Survey.objects.count()
+    active = Survey.objects.filter(is_active=True).count()
+    results = {}
+    for name, path, params in views:
+        results[name] = measure(client, path, params, repeat, cold)
+        results[name]['path'] = path
+        results[name]['params'] = params
+        if progress:
+            progress(name, results[name])
+    if activation:
+        results[ACTIVATION] = measure_activation(client, repeat)
+        if progress:
+            progress(ACTIVATION, results[ACTIVATION])
+    return {'surveys': surveys, 'active': active, 'views': results}
+
+
+def environment():
+
+    return {
+        'started': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'host': platform.node(),
+    }
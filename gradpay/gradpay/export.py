@@ -0,0 +1,74 @@
+'''
+Streaming exports. Rows are read through a server-side cursor where the
+database supports one and written out a line at a time, so exports run
+in one query and constant memory at any table size.
+'''
+
+import csv
+import json
+import itertools
+from cStringIO import StringIO
+
+from django.db import connections
+
+
+def stream_values(queryset, fields, chunk_size=2000):
+    """ Yield `fields` of each row in `queryset` as dicts. On PostgreSQL
+    rows come from a named (server-side) cursor `chunk_size` at a time;
+    other backends stream from a regular cursor. """
+
+    rows = queryset.values_list(*fields)
+    connection = connections[rows.db]
+    sql, params = rows.query.get_compiler(rows.db).as_sql()
+
+    if connection.vendor == 'postgresql':
+        # Open the connection, then declare the cursor on it directly
+        connection.cursor()
+        cursor = connection.connection.cursor(name='export_%d' % id(rows))
+        cursor.itersize = chunk_size
+    else:
+        cursor = connection.cursor()
+
+    try:
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for row in chunk:
+                yield dict(itertools.izip(fields, row))
+    finally:
+        cursor.close()
+
+
+def _encode(value):
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_lines(header, rows):
+    """ Yield a CSV header line, then one line per row. """
+
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for row in itertools.chain([header], rows):
+        writer.writerow([_encode(value) for value in row])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def ndjson_lines(header, rows):
+    """ Yield one JSON object per row, keyed by `header`. """
+
+    for row in rows:
+        yield json.dumps(dict(zip(header, row))) + '\n'
+
+
+# Line writers and content types by format name
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
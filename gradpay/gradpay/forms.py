@@ -33,8 +33,14 @@ DISPLAY_CHOICES = (
     ('stipend', 'Stipend'),
     ('teaching', 'Teaching %'),
     ('loans_fmt', 'Student Loans'),
+    ('stipend_p10', 'Stipend (10th percentile)'),
+    ('stipend_p25', 'Stipend (25th percentile)'),
+    ('stipend_p75', 'Stipend (75th percentile)'),
+    ('stipend_p90', 'Stipend (90th percentile)'),
 )
 
+DISPLAY_INITIAL = ['stipend', 'teaching', 'loans_fmt']
+
 NUMERIC_CHOICES = (
     ('stipend', 'Stipend'),
     ('loans', 'Student Loans'),
@@ -108,7 +114,7 @@ class ResultForm(forms.Form):
     display_variables = forms.MultipleChoiceField(
         required=False,
         choices=DISPLAY_CHOICES,
-        initial=[choice[0] for choice in DISPLAY_CHOICES],
+        initial=DISPLAY_INITIAL,
         widget=forms.CheckboxSelectMultiple,
     )
 
@@ -361,10 +367,15 @@ class SurveyForm(ModelForm):
         # Set active to False
         instance.active = False
 
+        # Fill in auto-generated fields from form data
+        instance.set_hidden(
+            [support.pk for support in self.cleaned_data.get('support_types', [])],
+            [degree.pk for degree in self.cleaned_data.get('degree', [])],
+        )
+
         # Save changes
         instance.save()
         self.save_m2m()
-        instance.save_hidden()
 
-        # Send activation email
-        activation.send_activation_email(instance)
+        # Queue activation email
+        activation.queue_activation_email(instance)
@@ -1,40 +1,101 @@
 import os
 import json
+import threading
+import marshal
 
 # Data from http://coastwatch.pfeg.noaa.gov/erddap/convert/fipscounty.json
 
 path, _ = os.path.split(os.path.realpath(__file__))
 filename = '%s/fips.json' % (path)
 
+# Precompiled index, written by the build_fips_index command. Uses
+# marshal, which loads several times faster than the JSON table
+index_filename = '%s/fips.idx' % (path)
+
+
+def build_maps(filename=filename):
+    """ Parse the FIPS JSON table into lookup maps. """
+
+    # Load JSON data
+    with open(filename) as fh:
+        data = json.load(fh)
+
+    # Initialize maps
+    maps = {}
+    maps['state_to_code'] = {}
+    maps['code_to_state'] = {}
+    maps['count_to_code'] = {}
+    maps['code_to_count'] = {}
+    maps['counties'] = []
+
+    cols = data['table']['columnNames']
+
+    # Build maps
+    for row in data['table']['rows']:
+        vals = dict(zip(cols, row))
+        name = vals['Name'].lower()
+        code = vals['FIPS'].lower()
+        if code.endswith('000'):
+            code = code[:2]
+            maps['state_to_code'][name] = code
+            maps['code_to_state'][code] = name
+        else:
+            maps['count_to_code'][name] = code
+            maps['code_to_count'][code] = name
+            state, county = vals['Name'].split(', ', 1)
+            maps['counties'].append((vals['FIPS'], state, county))
+
+    return maps
+
+
+def build_index(filename=filename, index_filename=index_filename):
+
+    with open(index_filename, 'wb') as fh:
+        marshal.dump(build_maps(filename), fh)
+
+
 class Fips(object):
+    """
+    FIPS state and county lookups. Maps are loaded on first use and
+    shared by every instance in the process, from the precompiled index
+    if it is up to date and from the JSON table otherwise.
+    """
+
+    _maps = {}
+    _lock = threading.Lock()
+
+    def __init__(self, filename=filename, index_filename=index_filename):
 
-    def __init__(self, filename=filename):
-
-        # Load JSON data
-        with open(filename) as fh:
-            self.data = json.load(fh)
-
-        # Initialize maps
-        self.map = {}
-        self.map['state_to_code'] = {}
-        self.map['code_to_state'] = {}
-        self.map['count_to_code'] = {}
-        self.map['code_to_count'] = {}
-
-        cols = self.data['table']['columnNames']
-
-        # Build maps
-        for row in self.data['table']['rows']:
-            vals = dict(zip(cols, row))
-            name = vals['Name'].lower()
-            code = vals['FIPS'].lower()
-            if code.endswith('000'):
-                code = code[:2]
-                self.map['state_to_code'][name] = code
-                self.map['code_to_state'][code] = name
-            else:
-                self.map['count_to_code'][name] = code
-                self.map['code_to_count'][code] = name
+        self.filename = filename
+        self.index_filename = index_filename
+
+    @property
+    def map(self):
+
+        maps = self._maps.get(self.filename)
+        if maps is None:
+            with self._lock:
+                maps = self._maps.get(self.filename)
+                if maps is None:
+                    maps = self._maps[self.filename] = self._load()
+        return maps
+
+    def _load(self):
+
+        try:
+            if os.path.getmtime(self.index_filename) >= os.path.getmtime(self.filename):
+                with open(self.index_filename, 'rb') as fh:
+                    return marshal.load(fh)
+        except (OSError, IOError, EOFError, ValueError, TypeError):
+            pass
+
+        return build_maps(self.filename)
+
+    def counties(self):
+        """ Yield (code, state, county) for every county, with names
+        in their original case. """
+
+        return iter(self.map['counties'])
 
     # Lookup functions
 
@@ -49,3 +110,28 @@ class Fips(object):
 
     def code_to_count(self, code):
         return self.map['code_to_count'].get(code, None)
+
+    # Batch lookup functions
+
+    def _batch(self, table, keys, lower):
+        # Look up each distinct key once
+        results = {}
+        for key in set(keys):
+            results[key] = table.get(key.lower() if lower else key, None)
+        return [results[key] for key in keys]
+
+    def codes_for_states(self, states):
+        return self._batch(self.map['state_to_code'], states, True)
+
+    def codes_for_counties(self, counties):
+        return self._batch(self.map['count_to_code'], counties, True)
+
+    def names_for_codes(self, codes):
+        """ State names for 2-digit codes, county names for 5-digit. """
+
+        states = self.map['code_to_state']
+        counties = self.map['code_to_count']
+        return [
+            states.get(code) if len(code) == 2 else counties.get(code)
+            for code in codes
+        ]
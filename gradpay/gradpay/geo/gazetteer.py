@@ -0,0 +1,92 @@
+'''Resolve counties offline from the bundled FIPS table.'''
+
+import re
+import csv
+
+import fips
+
+
+# County-equivalent suffixes dropped when matching names
+SUFFIX_RE = re.compile(
+    r'\s+(city and borough|county|parish|borough|census area|municipality)$'
+)
+
+
+def normalize(name):
+    """ Normalize a place name for matching: lower case, no punctuation,
+    "Saint"/"Ste." spelled "st", and no county-type suffix. """
+
+    name = name.lower().replace('&', ' and ')
+    name = re.sub(r"[.,'\-]", ' ', name)
+    name = re.sub(r'\b(saint|ste)\b', 'st', name)
+    name = ' '.join(name.split())
+    return SUFFIX_RE.sub('', name)
+
+
+def load_city_table(filename):
+    """ Read (state, city, county) rows from a CSV file. """
+
+    with open(filename) as fh:
+        return [tuple(row[:3]) for row in csv.reader(fh) if len(row) >= 3]
+
+
+class CountyResolver(object):
+    """
+    Gazetteer index over FIPS county names, plus an optional table of
+    (state, city, county) rows for cities whose county can't be guessed
+    from the name alone.
+    """
+
+    def __init__(self, fips_data=None, cities=()):
+
+        fips_data = fips_data or fips.Fips()
+
+        # (state, normalized county) -> (county, code)
+        self.counties = {}
+        # state -> [(county, code)]
+        self.by_state = {}
+        for code, state, county in fips_data.counties():
+            state = state.upper()
+            self.counties[(state, normalize(county))] = (county, code)
+            self.by_state.setdefault(state, []).append((county, code))
+
+        # (state, normalized city) -> (county, code)
+        self.cities = {}
+        for state, city, county in cities:
+            match = self.county(state, county)
+            if match[1]:
+                self.cities[(state.upper(), normalize(city))] = match
+
+    def county(self, state, county):
+        """ Look up a county by name, returning (county, code). """
+
+        return self.counties.get(
+            (state.upper(), normalize(county)), ('', '')
+        )
+
+    def county_code(self, state, county):
+
+        return self.county(state, county)[1]
+
+    def resolve(self, city, state):
+        """ Guess the county containing `city`, returning (county, code)
+        or ('', '') if it can't be resolved offline. """
+
+        state = state.upper()
+        city = normalize(city)
+
+        # Known city
+        if (state, city) in self.cities:
+            return self.cities[(state, city)]
+
+        # Single-county states and districts (e.g. DC)
+        if len(self.by_state.get(state, [])) == 1:
+            return self.by_state[state][0]
+
+        # Independent city (e.g. "St. Louis city", MO). A county merely
+        # named like the city is often elsewhere in the state (Houston
+        # County, TX), so that is left to the city table or geocoding
+        if (state, '%s city' % (city)) in self.counties:
+            return self.counties[(state, '%s city' % (city))]
+
+        return '', ''
@@ -1,33 +1,196 @@
+import os
+import json
 import time
+import threading
+from multiprocessing.pool import ThreadPool
+
 from pygeocoder import Geocoder, GeocoderError
 
 import fips
+import gazetteer
 
 
+# Loads lazily on first lookup
 f = fips.Fips()
+_resolver = []
 
 
-def geocode_institution(name, city, state):
+def get_resolver():
 
-    query = ', '.join([name, city, state])
+    if not _resolver:
+        _resolver.append(gazetteer.CountyResolver(f))
+    return _resolver[0]
+
+
+# Attempts at a lookup failing with a transient error, and the seconds
+# to wait before the first retry, doubled after each
+GEOCODE_ATTEMPTS = 3
+GEOCODE_RETRY_SECONDS = 2
+
+
+class GoogleGeocoder(object):
+    """ Look up counties with the Google geocoding API. Returns '' when
+    the API finds no county; other errors, such as OVER_QUERY_LIMIT, are
+    raised so they aren't taken for an answer. """
+
+    def county(self, name, city, state):
+
+        query = ', '.join([name, city, state])
+
+        try:
+            geo = Geocoder.geocode(query)
+        except GeocoderError as error:
+            if error.status == GeocoderError.G_GEO_ZERO_RESULTS:
+                return ''
+            raise
+
+        for result in geo.data:
+            for comp in result['address_components']:
+                if 'administrative_area_level_2' in comp['types']:
+                    return comp['long_name']
+
+        return ''
+
+
+class StubGeocoder(object):
+    """ Offline geocoder returning counties from a dict keyed by
+    (name, city, state); stands in for the network in tests. Exception
+    values are raised, standing in for API errors. """
+
+    def __init__(self, counties=None):
+        self.counties = counties or {}
+        self.calls = []
+
+    def county(self, name, city, state):
+        self.calls.append((name, city, state))
+        county = self.counties.get((name, city, state), '')
+        if isinstance(county, Exception):
+            raise county
+        return county
+
+
+class RateLimiter(object):
+    """ Thread-safe token bucket allowing `rate` calls per second on
+    average, with bursts of up to `burst` calls. """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+            with self.lock:
+                current = time.time()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (current - self.updated) * self.rate
+                )
+                self.updated = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
-    try:
-        geo = Geocoder.geocode(query)
-        time.sleep(2.5)
-    except GeocoderError as e:
-        return '', ''
 
-    for result in geo.data:
-        for comp in result['address_components']:
-            if 'administrative_area_level_2' in comp['types']:
-                county = comp['long_name']
-                break
+class GeocodeCache(object):
+    """ Thread-safe geocoding results, keyed by (name, city, state) and
+    kept in a JSON file so interrupted runs can resume. """
 
-    if 'county' not in locals():
+    def __init__(self, filename=None):
+
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.data = {}
+        if filename and os.path.exists(filename):
+            with open(filename) as fh:
+                self.data = json.load(fh)
+
+    @staticmethod
+    def _key(name, city, state):
+        return '|'.join([name, city, state])
+
+    def get(self, name, city, state):
+        with self.lock:
+            return self.data.get(self._key(name, city, state))
+
+    def set(self, name, city, state, county):
+        with self.lock:
+            self.data[self._key(name, city, state)] = county
+
+    def save(self):
+        """ Write the cache atomically so a crash can't corrupt it. """
+
+        if not self.filename:
+            return
+        with self.lock:
+            tmpname = '%s.tmp' % (self.filename)
+            with open(tmpname, 'w') as fh:
+                json.dump(self.data, fh)
+            os.rename(tmpname, self.filename)
+
+
+def county_code(state, county):
+
+    return get_resolver().county_code(state, county)
+
+
+def geocode_institution(name, city, state, geocoder=None):
+
+    geocoder = geocoder or GoogleGeocoder()
+    county = geocoder.county(name, city, state)
+
+    if not county:
         return '', ''
 
-    code = f.count_to_code(
-        ('%s, %s' % (state, county)).lower()
-    )
+    return county, county_code(state, county)
+
+
+def lookup_county(geocoder, limiter, institution, attempts=GEOCODE_ATTEMPTS,
+                  retry_seconds=GEOCODE_RETRY_SECONDS):
+    """ County of a (name, city, state) tuple, or None if every attempt
+    failed with an error. """
 
-    return county, code
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(retry_seconds * 2 ** (attempt - 1))
+        limiter.acquire()
+        try:
+            return geocoder.county(*institution)
+        except (GeocoderError, IOError):
+            pass
+    return None
+
+
+def geocode_institutions(institutions, geocoder, cache, limiter,
+                         workers=4, checkpoint=50, **retry):
+    """ Geocode (name, city, state) tuples concurrently, serving repeats
+    from `cache` and throttling lookups through `limiter`. Yields each
+    tuple with its (county, code), saving the cache every `checkpoint`
+    lookups. Lookups that keep failing yield ('', '') and aren't cached,
+    so the next run tries them again. """
+
+    def lookup(institution):
+        county = cache.get(*institution)
+        if county is None:
+            county = lookup_county(geocoder, limiter, institution, **retry)
+            if county is None:
+                return institution, ''
+            cache.set(*institution, county=county)
+        return institution, county
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.imap_unordered(lookup, institutions)
+        for count, (institution, county) in enumerate(results, 1):
+            if count % checkpoint == 0:
+                cache.save()
+            code = county_code(institution[2], county) if county else ''
+            yield institution, (county, code)
+    finally:
+        pool.terminate()
+        cache.save()
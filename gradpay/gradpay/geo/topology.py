@@ -0,0 +1,355 @@
+'''
+GeoJSON to quantized TopoJSON (https://github.com/mbostock/topojson).
+
+Coordinates are snapped to an integer grid, rings are cut into arcs at
+the points where neighbouring shapes meet, and each shared arc is stored
+once. Arcs are simplified independently with Visvalingam's algorithm,
+so shapes that share a border keep sharing it at every level.
+'''
+
+import os
+import gzip
+import json
+import math
+import heapq
+import hashlib
+import collections
+
+path, _ = os.path.split(os.path.realpath(__file__))
+static_dir = os.path.join(os.path.dirname(path), 'static', 'geo')
+
+# Built files go here, with a manifest of their hashed names
+build_dir = os.path.join(static_dir, 'build')
+manifest_filename = os.path.join(build_dir, 'manifest.json')
+
+# GeoJSON sources, by name
+SOURCES = ('us-states', 'us-counties')
+
+# Levels as (name, quantization, minimum point area in grid units, widest
+# map in CSS pixels they are drawn at); the last level has no limit. The
+# lower 48 states span about half the grid's width, so a level's grid
+# step is about 2 CSS pixels on its widest map. County shapes are cut
+# into arcs at nearly every point, so their size falls with quantization
+# rather than with the area threshold
+LEVELS = (
+    ('low', 500, 2, 480),
+    ('medium', 1000, 1, 960),
+    ('high', 2000, 0, None),
+)
+
+
+def _rings(geometry):
+    """ Rings of a Polygon or MultiPolygon, grouped by polygon. """
+
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def _quantize_ring(ring, transform):
+
+    (kx, ky), (x0, y0) = transform
+    points = []
+    for x, y in ring:
+        point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+        if not points or point != points[-1]:
+            points.append(point)
+    if points[0] != points[-1]:
+        points.append(points[0])
+    return points
+
+
+def _signed_area(ring):
+
+    return sum(
+        x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:])
+    ) / 2.0
+
+
+def _box_ring(ring, transform):
+    """ Grid cells covering a ring's extent, at least one cell across,
+    as a closed ring wound the same way as the original. """
+
+    (kx, ky), (x0, y0) = transform
+    xs = [(x - x0) / kx for x, _ in ring]
+    ys = [(y - y0) / ky for _, y in ring]
+    left, bottom = int(math.floor(min(xs))), int(math.floor(min(ys)))
+    right = max(int(math.ceil(max(xs))), left + 1)
+    top = max(int(math.ceil(max(ys))), bottom + 1)
+    box = [(left, bottom), (right, bottom), (right, top), (left, top), (left, bottom)]
+    if (_signed_area(box) > 0) != (_signed_area(ring) > 0):
+        box.reverse()
+    return box
+
+
+def _junctions(rings):
+    """ Points where rings meet or part: those seen with more than one
+    pair of neighbours. """
+
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        for idx in range(len(ring) - 1):
+            point = ring[idx]
+            pair = frozenset([ring[idx - 1], ring[idx + 1]])
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _canonical(ring):
+    """ Rotate a closed ring without junctions to start at its least
+    point, so rings shared whole are cut identically. """
+
+    points = ring[:-1]
+    start = points.index(min(points))
+    points = points[start:] + points[:start]
+    return points + [points[0]]
+
+
+def _cut(ring, junctions):
+    """ Split a closed ring into arcs ending at junctions. """
+
+    points = ring[:-1]
+    cuts = [idx for idx, point in enumerate(points) if point in junctions]
+    if not cuts:
+        return [_canonical(ring)]
+    points = points[cuts[0]:] + points[:cuts[0]] + [points[cuts[0]]]
+    arcs, start = [], 0
+    for idx in range(1, len(points)):
+        if points[idx] in junctions:
+            arcs.append(points[start:idx + 1])
+            start = idx
+    return arcs
+
+
+def _area(a, b, c):
+
+    return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2.0
+
+
+def visvalingam(arc):
+    """ Effective area of each point of an arc; endpoints are infinite.
+    A point's area never falls below that of points removed before it. """
+
+    areas = [float('inf')] * len(arc)
+    if len(arc) < 3:
+        return areas
+    prev = list(range(-1, len(arc) - 1))
+    following = list(range(1, len(arc) + 1))
+    heap = [(_area(arc[idx - 1], arc[idx], arc[idx + 1]), idx)
+            for idx in range(1, len(arc) - 1)]
+    heapq.heapify(heap)
+    current = dict((idx, area) for area, idx in heap)
+    floor = 0
+    while heap:
+        area, idx = heapq.heappop(heap)
+        if current.get(idx) != area:
+            continue
+        del current[idx]
+        floor = max(floor, area)
+        areas[idx] = floor
+        before, after = prev[idx], following[idx]
+        following[before], prev[after] = after, before
+        for neighbour in (before, after):
+            if 0 < neighbour < len(arc) - 1:
+                area = _area(arc[prev[neighbour]], arc[neighbour], arc[following[neighbour]])
+                current[neighbour] = area
+                heapq.heappush(heap, (area, neighbour))
+    return areas
+
+
+def simplify(arc, areas, min_area):
+    """ Drop points with effective area below `min_area`, keeping enough
+    of a closed arc to remain a ring. """
+
+    keep = [area >= min_area for area in areas]
+    if arc[0] == arc[-1] and sum(keep) < 4:
+        ranked = sorted(range(1, len(arc) - 1), key=lambda idx: -areas[idx])
+        for idx in ranked[:4 - sum(keep)]:
+            keep[idx] = True
+    return [point for point, kept in zip(arc, keep) if kept]
+
+
+class Topology(object):
+    """
+    Shared-arc topology of polygon features, quantized to a grid of
+    `quantization` steps along each axis of their bounding box.
+    """
+
+    def __init__(self, features, quantization=10000):
+
+        self.features = features
+        points = [
+            point
+            for feature in features
+            for polygon in _rings(feature['geometry'])
+            for ring in polygon
+            for point in ring
+        ]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        x0, y0 = min(xs), min(ys)
+        kx = (max(xs) - x0) / (quantization - 1) or 1
+        ky = (max(ys) - y0) / (quantization - 1) or 1
+        self.transform = (kx, ky), (x0, y0)
+
+        # Quantize every ring, keeping each feature's structure
+        self.shapes = [
+            self._quantize_shape(feature['geometry'])
+            for feature in features
+        ]
+        junctions = _junctions(
+            ring for shape in self.shapes for polygon in shape for ring in polygon
+        )
+
+        # Cut rings into arcs, storing each distinct arc once
+        self.arcs = []
+        index = {}
+        self.geometries = []
+        for shape in self.shapes:
+            polygons = []
+            for polygon in shape:
+                rings = []
+                for ring in polygon:
+                    refs = []
+                    for arc in _cut(ring, junctions):
+                        key = tuple(arc)
+                        if key in index:
+                            refs.append(index[key])
+                        elif key[::-1] in index:
+                            refs.append(~index[key[::-1]])
+                        else:
+                            index[key] = len(self.arcs)
+                            refs.append(len(self.arcs))
+                            self.arcs.append(arc)
+                    rings.append(refs)
+                polygons.append(rings)
+            self.geometries.append(polygons)
+
+        self.areas = [visvalingam(arc) for arc in self.arcs]
+
+    def _quantize_shape(self, geometry):
+        """ Quantized polygons of a geometry, dropping rings that
+        collapse below three distinct points and polygons whose outer
+        ring collapses. A shape that collapses whole is kept as the grid
+        cells covering its largest polygon, so it is still drawn. """
+
+        polygons = []
+        for polygon in _rings(geometry):
+            rings = [_quantize_ring(ring, self.transform) for ring in polygon]
+            if len(rings[0]) >= 4:
+                polygons.append([ring for ring in rings if len(ring) >= 4])
+        if not polygons:
+            outer = max(
+                (polygon[0] for polygon in _rings(geometry)),
+                key=lambda ring: abs(_signed_area(ring)),
+            )
+            polygons.append([_box_ring(outer, self.transform)])
+        return polygons
+
+    def point_count(self, min_area=0):
+
+        return sum(
+            len(simplify(arc, areas, min_area))
+            for arc, areas in zip(self.arcs, self.areas)
+        )
+
+    def to_topojson(self, name, min_area=0):
+        """ TopoJSON with one GeometryCollection `name`, dropping points
+        with effective area under `min_area` square grid units. """
+
+        arcs = []
+        for arc, areas in zip(self.arcs, self.areas):
+            points = simplify(arc, areas, min_area)
+            # Delta-encode positions
+            encoded = [list(points[0])]
+            for (x1, y1), (x2, y2) in zip(points, points[1:]):
+                encoded.append([x2 - x1, y2 - y1])
+            arcs.append(encoded)
+
+        geometries = []
+        for feature, polygons in zip(self.features, self.geometries):
+            geometry = collections.OrderedDict()
+            if len(polygons) == 1:
+                geometry['type'] = 'Polygon'
+                geometry['arcs'] = polygons[0]
+            else:
+                geometry['type'] = 'MultiPolygon'
+                geometry['arcs'] = polygons
+            if 'id' in feature:
+                geometry['id'] = feature['id']
+            geometries.append(geometry)
+
+        (kx, ky), (x0, y0) = self.transform
+        return {
+            'type': 'Topology',
+            'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+            'objects': {
+                name: {'type': 'GeometryCollection', 'geometries': geometries},
+            },
+            'arcs': arcs,
+        }
+
+
+def build(sources=SOURCES, levels=LEVELS):
+    """ Write each source at each level as TopoJSON with content-hashed
+    names, plus gzipped copies, and a manifest listing them. Returns
+    the manifest. """
+
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_dir, '%s.json' % (name))) as fh:
+            features = json.load(fh)['features']
+        entries = manifest[name] = []
+        for level, quantization, min_area, max_width in levels:
+            topology = Topology(features, quantization)
+            body = json.dumps(
+                topology.to_topojson(name, min_area), separators=(',', ':')
+            )
+            digest = hashlib.sha1(body).hexdigest()[:12]
+            filename = '%s.%s.%s.json' % (name, level, digest)
+            with open(os.path.join(build_dir, filename), 'wb') as fh:
+                fh.write(body)
+            with gzip.GzipFile(os.path.join(build_dir, filename + '.gz'), 'wb', 9, mtime=0) as fh:
+                fh.write(body)
+            entries.append({
+                'level': level,
+                'max_width': max_width,
+                'path': 'geo/build/%s' % (filename),
+                'bytes': len(body),
+            })
+
+    # Remove files from earlier builds
+    current = set(
+        os.path.basename(entry['path'])
+        for entries in manifest.values() for entry in entries
+    )
+    for filename in os.listdir(build_dir):
+        if filename.replace('.gz', '') not in current and filename != os.path.basename(manifest_filename):
+            os.remove(os.path.join(build_dir, filename))
+
+    with open(manifest_filename, 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+_manifest = {}
+
+
+def load_manifest():
+    """ Built levels by source name, reloaded when the manifest changes;
+    empty if nothing has been built. """
+
+    try:
+        mtime = os.path.getmtime(manifest_filename)
+    except OSError:
+        return {}
+    if _manifest.get('mtime') != mtime:
+        with open(manifest_filename) as fh:
+            _manifest['data'] = json.load(fh)
+        _manifest['mtime'] = mtime
+    return _manifest['data']
@@ -0,0 +1,134 @@
+'''
+Histograms computed in the database. Bin edges come from one aggregate
+query and bin counts from one grouped query, so only the edges and
+counts ever leave the database.
+'''
+
+import math
+
+from django.db import connection
+from django.db.models import Count, Max, Min
+
+from aggregates import Percentile
+
+
+BIN_METHODS = ('width', 'quantile', 'fd')
+
+
+def nice_step(span, bins):
+    """ Round bin width, a power of ten times 1, 2 or 5, giving about
+    `bins` bins over `span` (as d3's linear ticks). """
+
+    step = 10 ** math.floor(math.log10(span / bins))
+    error = bins / span * step
+    if error <= 0.15:
+        step *= 10
+    elif error <= 0.35:
+        step *= 5
+    elif error <= 0.75:
+        step *= 2
+    return step
+
+
+def width_edges(low, high, bins):
+    """ Edges of round, equal-width bins covering [low, high]. """
+
+    if low == high:
+        return [low, high + 1]
+    step = nice_step(float(high - low), bins)
+    start = math.floor(low / step)
+    stop = math.ceil(high / step)
+    if stop == start:
+        stop += 1
+    return [step * idx for idx in range(int(start), int(stop) + 1)]
+
+
+def quantile_edges(queryset, field, bins):
+    """ Edges of bins holding equal numbers of values. """
+
+    fractions = [float(idx) / bins for idx in range(bins + 1)]
+    stats = queryset.aggregate(**dict(
+        ('q%d' % idx, Percentile(field, fraction))
+        for idx, fraction in enumerate(fractions)
+    ))
+    edges = sorted(set(stats['q%d' % idx] for idx in range(bins + 1)))
+    if len(edges) == 1:
+        edges.append(edges[0] + 1)
+    return edges
+
+
+def fd_edges(queryset, field, bins, max_bins):
+    """ Edges of equal-width bins sized by the Freedman-Diaconis rule,
+    falling back to `bins` bins if the values have no spread. """
+
+    stats = queryset.aggregate(
+        low=Min(field), high=Max(field), n=Count(field),
+        q1=Percentile(field, 0.25), q3=Percentile(field, 0.75),
+    )
+    low, high = stats['low'], stats['high']
+    if low == high:
+        return [low, high + 1]
+
+    width = 2 * (stats['q3'] - stats['q1']) / stats['n'] ** (1 / 3.0)
+    if width > 0:
+        bins = min(int(math.ceil((high - low) / width)), max_bins)
+    width = float(high - low) / bins
+    return [low + width * idx for idx in range(bins)] + [high]
+
+
+def bin_edges(queryset, field, method, bins, max_bins):
+
+    if method == 'quantile':
+        return quantile_edges(queryset, field, bins)
+    if method == 'fd':
+        return fd_edges(queryset, field, bins, max_bins)
+
+    stats = queryset.aggregate(low=Min(field), high=Max(field))
+    return width_edges(stats['low'], stats['high'], bins)
+
+
+def bin_counts(queryset, field, edges):
+    """ Count values in each bin with a CASE expression grouped in the
+    database. Bins are closed on the left; the last is also closed on
+    the right. """
+
+    qn = connection.ops.quote_name
+    column = '%s.%s' % (
+        qn(queryset.model._meta.db_table),
+        qn(queryset.model._meta.get_field(field).column),
+    )
+    cases = ' '.join(
+        'WHEN %s < %%s THEN %d' % (column, idx)
+        for idx in range(len(edges) - 2)
+    )
+    case = 'CASE %s ELSE %d END' % (cases, len(edges) - 2)
+
+    rows = queryset.extra(
+        select={'bin': case},
+        select_params=edges[1:-1],
+    ).values('bin').annotate(n=Count('pk')).order_by()
+
+    counts = [0] * (len(edges) - 1)
+    for row in rows:
+        counts[row['bin']] = row['n']
+    return counts
+
+
+def histogram(queryset, field, method='width', bins=10, max_bins=50):
+    """ Histogram of `field` over `queryset`, as {'edges', 'counts'}.
+    Methods are 'width' (round, equal-width bins), 'quantile' (equal
+    counts) and 'fd' (Freedman-Diaconis bin width). """
+
+    if method not in BIN_METHODS:
+        raise ValueError('Unknown binning method %r' % (method,))
+
+    queryset = queryset.filter(**{'%s__isnull' % field: False})
+    if not queryset.exists():
+        return {'edges': [], 'counts': []}
+
+    bins = max(1, min(bins, max_bins))
+    edges = bin_edges(queryset, field, method, bins, max_bins)
+    return {
+        'edges': [round(edge, 2) for edge in edges],
+        'counts': bin_counts(queryset, field, edges),
+    }
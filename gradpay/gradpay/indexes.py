@@ -0,0 +1,85 @@
+'''
+Create the indexes the models declare, and the composite indexes listed
+in models.COMPOSITE_INDEXES, that the database lacks. syncdb only
+indexes the tables it creates, and knows nothing of composite indexes,
+so these are created with the create_indexes command.
+'''
+
+import re
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import get_app, get_models
+
+from models import COMPOSITE_INDEXES
+
+
+INDEX_NAME_RE = re.compile(r'^CREATE (?:UNIQUE )?INDEX ["`]?(\w+)["`]?')
+
+
+def index_names(connection, table):
+    """ Names of the indexes on `table`. """
+
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+        return set(row[0] for row in cursor.fetchall())
+    if connection.vendor == 'sqlite':
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s",
+            [table],
+        )
+        return set(row[0] for row in cursor.fetchall())
+    if connection.vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % (connection.ops.quote_name(table)))
+        return set(row[2] for row in cursor.fetchall())
+    raise NotImplementedError('Index lookup not supported on %s' % (connection.vendor))
+
+
+def composite_index_sql(connection, model, name, fields, unique=False):
+
+    qn = connection.ops.quote_name
+    columns = [model._meta.get_field(field).column for field in fields]
+    return 'CREATE %sINDEX %s ON %s (%s);' % (
+        'UNIQUE ' if unique else '', qn(name), qn(model._meta.db_table),
+        ', '.join(qn(column) for column in columns),
+    )
+
+
+def missing_indexes(app_label='gradpay', using='default'):
+    """ CREATE INDEX statements for the declared indexes of an app's
+    models, and the composite indexes, that the database lacks, as
+    (name, sql) pairs. """
+
+    connection = connections[using]
+    style = no_style()
+    existing = {}
+    missing = []
+
+    def add(model, name, sql):
+        table = model._meta.db_table
+        if table not in existing:
+            existing[table] = index_names(connection, table)
+        if name not in existing[table]:
+            missing.append((name, sql))
+
+    for model in get_models(get_app(app_label)):
+        for sql in connection.creation.sql_indexes_for_model(model, style):
+            add(model, INDEX_NAME_RE.match(sql).group(1), sql)
+    for model, name, fields, unique in COMPOSITE_INDEXES:
+        if model._meta.app_label == app_label:
+            add(model, name, composite_index_sql(connection, model, name, fields, unique))
+    return missing
+
+
+def create_indexes(app_label='gradpay', using='default', progress=None):
+    """ Create the missing indexes, returning their names. """
+
+    missing = missing_indexes(app_label, using)
+    cursor = connections[using].cursor()
+    for name, sql in missing:
+        with transaction.commit_on_success(using=using):
+            cursor.execute(sql)
+        if progress:
+            progress(name, sql)
+    return [name for name, _ in missing]
@@ -1,40 +1,62 @@
-import re
-import functools
+from django.conf import settings
+from django.db.models import signals
+from django.utils.translation import ugettext as _
 
 from selectable.base import ModelLookup
 from selectable.registry import registry, LookupAlreadyRegistered
 
 from models import Department, Institution
+from search import ModelIndex
 
 
-class FlexModelLookup(ModelLookup):
+class IndexedModelLookup(ModelLookup):
+    """
+    Lookup served from an in-process name index instead of a database
+    query per keystroke.
+    """
 
-    sub_patterns = []
+    index = None
 
-    def get_query(self, request, term):
-        term = functools.reduce(
-            lambda x, y: re.sub(y[0], y[1], x),
-            self.sub_patterns,
-            term,
+    @classmethod
+    def build_index(cls):
+
+        cls.index = ModelIndex(
+            cls.model._default_manager.only('pk', 'name'),
+            ttl=settings.LOOKUP_INDEX_TTL,
+        )
+        signals.post_save.connect(cls.index.invalidate, sender=cls.model, weak=False)
+        signals.post_delete.connect(cls.index.invalidate, sender=cls.model, weak=False)
+
+    @classmethod
+    def dictionary(cls):
+        """ (version, body, gzipped body) of the lookup's dictionary. """
+
+        return cls.index.get().dictionary(
+            lambda item: item.pk,
+            extra={
+                'limit': getattr(settings, 'SELECTABLE_MAX_LIMIT', 25),
+                'more': _('Show more results'),
+            },
         )
-        term = self.join_pattern.join(term)
-        return super(FlexModelLookup, self).get_query(request, term)
+
+    def get_query(self, request, term):
+        return self.index.search(term)
 
 
-class DepartmentLookup(ModelLookup):
+class DepartmentLookup(IndexedModelLookup):
 
     model = Department
     search_fields = ('name__icontains',)
 
+DepartmentLookup.build_index()
+
 
-class InstitutionLookup(FlexModelLookup):
+class InstitutionLookup(IndexedModelLookup):
 
     model = Institution
-    search_fields = ('name__iregex',)
-    sub_patterns = [
-        ['[\s\-,]', ''],
-    ]
-    join_pattern = '[\s\-,]*'
+    search_fields = ('name__icontains',)
+
+InstitutionLookup.build_index()
 
 
 for lookup in [DepartmentLookup, InstitutionLookup]:
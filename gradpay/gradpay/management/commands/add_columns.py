@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from gradpay import schema
+
+
+class Command(NoArgsCommand):
+
+    help = 'Add columns of fields added to existing models, which syncdb skips'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Print the statements instead of running them',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        if options['dry_run']:
+            for name, sql in schema.missing_columns():
+                self.stdout.write('%s\n' % (sql))
+            return
+
+        def progress(name, sql):
+            self.stdout.write('Added %s\n' % (name))
+
+        added = schema.add_columns(progress=progress)
+        self.stdout.write('Added %d columns\n' % len(added))
@@ -1,30 +1,150 @@
 '''Add FIPS codes for state and county to each institition.'''
 
+import os
+from optparse import make_option
+
+from django.conf import settings
 from django.core.management.base import NoArgsCommand
+from django.utils.importlib import import_module
+from django.db import transaction
 
 from gradpay.models import Institution
 from gradpay.geo import geocode
+from gradpay.geo import gazetteer
+
+
+def load_geocoder(path):
+
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
 
 
 class Command(NoArgsCommand):
 
     help = 'Add FIPS codes'
 
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of concurrent geocoding requests',
+        ),
+        make_option(
+            '--rate',
+            type='float',
+            dest='rate',
+            default=settings.GEOCODE_RATE,
+            help='Maximum geocoding requests per second',
+        ),
+        make_option(
+            '--cache',
+            dest='cache',
+            default=settings.GEOCODE_CACHE,
+            help='File caching geocoding results between runs',
+        ),
+        make_option(
+            '--backend',
+            dest='backend',
+            default=settings.GEOCODER_BACKEND,
+            help='Dotted path to the geocoder class',
+        ),
+        make_option(
+            '--offline',
+            action='store_true',
+            dest='offline',
+            default=False,
+            help='Resolve counties from local data only, without geocoding',
+        ),
+        make_option(
+            '--cities',
+            dest='cities',
+            default=settings.GAZETTEER_CITIES,
+            help='CSV file of state, city, county rows for --offline',
+        ),
+        make_option(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Geocode institutions that already have a county code',
+        ),
+    )
+
     def handle_noargs(self, **options):
 
-        for inst in Institution.objects.all():
+        institutions = Institution.objects.all()
+
+        # Get state info
+        for inst in institutions.filter(state_code=''):
+            inst.state_code = geocode.f.state_to_code(inst.state) or ''
+            inst.save()
+
+        # Get county info
+        if not options['all']:
+            institutions = institutions.filter(county_code='')
+
+        if options['offline']:
+            return self.resolve_offline(institutions, **options)
 
-            # Get state info
-            if inst.state_code is None:
-                inst.state_code = geocode.f.state_to_code(inst.state)
+        by_key = {}
+        for inst in institutions:
+            by_key.setdefault((inst.name, inst.city, inst.state), []).append(inst)
 
-            # Get county info
-            if True:  # inst.county is None or inst.county_code is None:
-                inst.county, inst.county_code = geocode.geocode_institution(
-                    inst.name,
-                    inst.city,
-                    inst.state
-                )
+        results = geocode.geocode_institutions(
+            by_key.keys(),
+            geocoder=load_geocoder(options['backend']),
+            cache=geocode.GeocodeCache(options['cache']),
+            limiter=geocode.RateLimiter(options['rate']),
+            workers=options['workers'],
+        )
+
+        for count, (key, (county, code)) in enumerate(results, 1):
 
             # Save changes
-            inst.save()
+            for inst in by_key[key]:
+                inst.county, inst.county_code = county, code
+                inst.save()
+
+            if count % 50 == 0:
+                self.stdout.write('Geocoded %d of %d\n' % (count, len(by_key)))
+
+    @transaction.commit_on_success
+    def resolve_offline(self, institutions, **options):
+
+        # Known cities from the city table and earlier geocoding runs
+        cities = []
+        if os.path.exists(options['cities']):
+            cities.extend(gazetteer.load_city_table(options['cities']))
+        else:
+            self.stderr.write(
+                'WARNING: city table %s not found. Only independent cities, '
+                'single-county states and DC, and cities in the geocoding '
+                'cache will be resolved; see README.md for how to build the '
+                'table.\n' % (options['cities'])
+            )
+        for key, county in geocode.GeocodeCache(options['cache']).data.iteritems():
+            name, city, state = key.split('|')
+            if county:
+                cities.append((state, city, county))
+
+        resolver = gazetteer.CountyResolver(geocode.f, cities)
+
+        # One UPDATE per county
+        by_county = {}
+        rows = list(institutions.values_list('pk', 'city', 'state'))
+        for pk, city, state in rows:
+            county, code = resolver.resolve(city, state)
+            if code:
+                by_county.setdefault((county, code), []).append(pk)
+
+        for (county, code), pks in by_county.iteritems():
+            Institution.objects.filter(
+                pk__in=pks
+            ).update(county=county, county_code=code)
+
+        resolved = sum(len(pks) for pks in by_county.itervalues())
+        self.stdout.write(
+            'Resolved %d of %d institutions\n' % (resolved, len(rows))
+        )
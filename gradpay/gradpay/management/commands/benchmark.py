@@ -0,0 +1,119 @@
+import json
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from gradpay import benchmark
+from gradpay.models import Survey
+from gradpay.synthetic import generate_surveys
+
+
+class Command(NoArgsCommand):
+
+    help = (
+        'Benchmark the analytics views and survey activation, which only '
+        'activates synthetic surveys. With --scales, synthetic surveys are added to reach each table size in '
+        'turn before measuring.'
+    )
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--scales',
+            dest='scales',
+            default='',
+            help='Comma-separated survey counts, e.g. 10000,100000,1000000',
+        ),
+        make_option(
+            '--repeat',
+            type='int',
+            dest='repeat',
+            default=20,
+            help='Requests per view',
+        ),
+        make_option(
+            '--warm',
+            action='store_false',
+            dest='cold',
+            default=True,
+            help='Keep the cache between requests',
+        ),
+        make_option(
+            '--views',
+            dest='views',
+            default='',
+            help='Comma-separated view names, including %s for survey '
+                 'activation [default: all]' % (benchmark.ACTIVATION),
+        ),
+        make_option(
+            '--seed',
+            type='int',
+            dest='seed',
+            default=0,
+            help='Random seed for synthetic surveys',
+        ),
+        make_option(
+            '--allow-synthetic',
+            action='store_true',
+            dest='allow_synthetic',
+            default=False,
+            help='Confirm that --scales may add synthetic surveys to the '
+                 'configured database',
+        ),
+        make_option(
+            '--output',
+            dest='output',
+            default='benchmark.json',
+            help='File to write results to',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        views = benchmark.BENCHMARK_VIEWS
+        activation = True
+        if options['views']:
+            names = options['views'].split(',')
+            activation = benchmark.ACTIVATION in names
+            views = [view for view in views if view[0] in names]
+            if len(views) + activation != len(names):
+                raise CommandError('Unknown view in %s' % options['views'])
+
+        scales = sorted(int(scale) for scale in options['scales'].split(',') if scale)
+        if scales and not options['allow_synthetic']:
+            raise CommandError(
+                '--scales adds active surveys to %s. Pass --allow-synthetic '
+                'if it is not a production database; delete_synthetic_surveys '
+                'removes them again' % (settings.DATABASES['default']['NAME'])
+            )
+
+        def progress(name, result):
+            self.stdout.write('  %-22s p50 %9.1f ms  p90 %9.1f ms  %3d queries\n' % (
+                name, result['p50_ms'], result['p90_ms'], result['queries']
+            ))
+
+        report = benchmark.environment()
+        report['repeat'] = options['repeat']
+        report['cold'] = options['cold']
+        report['runs'] = []
+
+        for scale in scales or [None]:
+            run = {}
+            if scale is not None:
+                missing = scale - Survey.objects.count()
+                if missing > 0:
+                    self.stdout.write('Generating %d surveys\n' % missing)
+                    start = time.time()
+                    generate_surveys(missing, seed=options['seed'] + scale)
+                    run['generate_seconds'] = round(time.time() - start, 3)
+            self.stdout.write('Measuring at %d surveys\n' % Survey.objects.count())
+            run.update(benchmark.run_views(
+                views, options['repeat'], options['cold'], progress, activation,
+            ))
+            run['scale'] = scale
+            report['runs'].append(run)
+
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        self.stdout.write('Wrote %s\n' % options['output'])
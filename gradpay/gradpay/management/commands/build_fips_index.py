@@ -0,0 +1,12 @@
+from django.core.management.base import NoArgsCommand
+
+from gradpay.geo import fips
+
+
+class Command(NoArgsCommand):
+
+    help = 'Precompile the FIPS lookup index'
+
+    def handle_noargs(self, **options):
+        fips.build_index()
+        self.stdout.write('Wrote %s\n' % fips.index_filename)
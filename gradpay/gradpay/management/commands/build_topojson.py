@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+
+from gradpay.geo import topology
+
+
+class Command(NoArgsCommand):
+
+    help = 'Build multi-resolution TopoJSON for the choropleth maps'
+
+    def handle_noargs(self, **options):
+        manifest = topology.build()
+        for name in sorted(manifest):
+            for entry in manifest[name]:
+                self.stdout.write('Wrote %s (%d bytes)\n' % (entry['path'], entry['bytes']))
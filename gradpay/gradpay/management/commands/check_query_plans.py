@@ -0,0 +1,71 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from gradpay import plans
+from gradpay import indexes
+
+
+class Command(NoArgsCommand):
+
+    help = (
+        'EXPLAIN the queries of the analytics views and fail if any reads '
+        'the survey or aggregate table sequentially'
+    )
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--views',
+            dest='views',
+            default='',
+            help='Comma-separated view names [default: %s]' % ','.join(plans.PLAN_VIEWS),
+        ),
+        make_option(
+            '--plans',
+            action='store_true',
+            dest='plans',
+            default=False,
+            help='Show the plan of every query',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        views = plans.PLAN_VIEWS
+        if options['views']:
+            views = options['views'].split(',')
+            unknown = set(views) - set(plans.PLAN_VIEWS)
+            if unknown:
+                raise CommandError('Unknown view in %s' % options['views'])
+
+        missing = indexes.missing_indexes()
+        if missing:
+            raise CommandError(
+                'Missing indexes %s; run create_indexes first'
+                % ', '.join(name for name, _ in missing)
+            )
+
+        plans.analyze()
+
+        try:
+            results = plans.check_plans(views)
+        except NotImplementedError as error:
+            raise CommandError(str(error))
+
+        failures = 0
+        for view, sql, params, plan, scans in results:
+            if scans:
+                failures += 1
+                status = 'SCAN %s' % ', '.join(scans)
+            else:
+                status = 'ok'
+            self.stdout.write('%-22s %s\n' % (view, status))
+            if scans or options['plans']:
+                self.stdout.write('  %s\n' % (sql.encode('utf-8')))
+                for line in plan:
+                    self.stdout.write('    %s\n' % (line.encode('utf-8')))
+
+        if failures:
+            raise CommandError('%d of %d queries read a large table sequentially'
+                               % (failures, len(results)))
+        self.stdout.write('Checked %d queries\n' % len(results))
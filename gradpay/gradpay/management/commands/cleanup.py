@@ -1,3 +1,5 @@
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 
 from gradpay.models import Survey
@@ -7,5 +9,34 @@ class Command(NoArgsCommand):
 
     help = 'Delete expired surveys'
 
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Count expired surveys without deleting them',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=1000,
+            help='Number of surveys to delete per transaction',
+        ),
+    )
+
     def handle_noargs(self, **options):
-        Survey.objects.delete_expired_surveys()
+
+        if options['dry_run']:
+            count = Survey.objects.expired_surveys().count()
+            self.stdout.write('%d expired surveys would be deleted\n' % count)
+            return
+
+        def progress(deleted, total):
+            self.stdout.write('Deleted %d of %d expired surveys\n' % (deleted, total))
+
+        Survey.objects.delete_expired_surveys(
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from gradpay import indexes
+
+
+class Command(NoArgsCommand):
+
+    help = 'Create indexes declared in the models but missing from the database'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Print the statements instead of running them',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        if options['dry_run']:
+            for name, sql in indexes.missing_indexes():
+                self.stdout.write('%s\n' % (sql))
+            return
+
+        def progress(name, sql):
+            self.stdout.write('Created %s\n' % (name))
+
+        created = indexes.create_indexes(progress=progress)
+        self.stdout.write('Created %d indexes\n' % len(created))
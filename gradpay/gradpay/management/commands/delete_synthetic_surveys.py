@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from gradpay.synthetic import delete_synthetic_surveys, synthetic_surveys
+
+
+class Command(NoArgsCommand):
+
+    help = 'Delete the surveys inserted by generate_surveys and benchmark --scales'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Count synthetic surveys without deleting them',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=5000,
+            help='Number of surveys to delete per transaction',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        if options['dry_run']:
+            count = synthetic_surveys().count()
+            self.stdout.write('%d synthetic surveys would be deleted\n' % count)
+            return
+
+        def progress(deleted, total):
+            self.stdout.write('Deleted %d of %d synthetic surveys\n' % (deleted, total))
+
+        delete_synthetic_surveys(
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
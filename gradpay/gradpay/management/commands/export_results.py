@@ -0,0 +1,77 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from gradpay import export
+from gradpay.models import Degree
+from gradpay.views import export_results
+
+
+class Command(NoArgsCommand):
+
+    help = 'Export the aggregated results table as CSV or NDJSON'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--grouping-vars',
+            dest='grouping_vars',
+            default='institution',
+            help='Comma-separated grouping variables',
+        ),
+        make_option(
+            '--display-vars',
+            dest='display_vars',
+            default='stipend',
+            help='Comma-separated display variables',
+        ),
+        make_option(
+            '--degree',
+            type='int',
+            dest='degree',
+            default=None,
+            help='Degree id [default: PhD]',
+        ),
+        make_option(
+            '--search',
+            dest='search',
+            default='',
+            help='Only export rows matching this search term',
+        ),
+        make_option(
+            '--format',
+            dest='format',
+            default='csv',
+            help='Output format: %s' % ', '.join(sorted(export.EXPORT_FORMATS)),
+        ),
+        make_option(
+            '--output',
+            dest='output',
+            default=None,
+            help='File to write to [default: standard output]',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        if options['format'] not in export.EXPORT_FORMATS:
+            raise CommandError('Unknown format %s' % options['format'])
+
+        grouping_variables = options['grouping_vars'].split(',')
+        display_variables = [
+            var for var in options['display_vars'].split(',') if var
+        ] + ['num_resp']
+        degree = options['degree'] or Degree.objects.phd_id()
+
+        lines = export_results(
+            grouping_variables, display_variables, degree,
+            options['search'], options['format'],
+        )
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
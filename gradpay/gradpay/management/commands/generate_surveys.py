@@ -0,0 +1,78 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from gradpay.synthetic import generate_surveys
+
+
+class Command(NoArgsCommand):
+
+    help = 'Insert synthetic surveys for load testing'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--count',
+            type='int',
+            dest='count',
+            default=10000,
+            help='Number of surveys to insert',
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=5000,
+            help='Number of surveys per INSERT',
+        ),
+        make_option(
+            '--seed',
+            type='int',
+            dest='seed',
+            default=None,
+            help='Random seed, for repeatable data',
+        ),
+        make_option(
+            '--active-fraction',
+            type='float',
+            dest='active_fraction',
+            default=0.9,
+            help='Fraction of surveys that are activated',
+        ),
+        make_option(
+            '--no-refresh',
+            action='store_false',
+            dest='refresh',
+            default=True,
+            help='Skip rebuilding the aggregate tables',
+        ),
+        make_option(
+            '--allow-synthetic',
+            action='store_true',
+            dest='allow_synthetic',
+            default=False,
+            help='Confirm that the configured database may get synthetic '
+                 'surveys, which the results pages count',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        if not options['allow_synthetic']:
+            raise CommandError(
+                'This adds active surveys to %s. Pass --allow-synthetic if it '
+                'is not a production database; delete_synthetic_surveys '
+                'removes them again' % (settings.DATABASES['default']['NAME'])
+            )
+
+        def progress(inserted, total):
+            self.stdout.write('Inserted %d of %d surveys\n' % (inserted, total))
+
+        generate_surveys(
+            options['count'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            active_fraction=options['active_fraction'],
+            refresh=options['refresh'],
+            progress=progress,
+        )
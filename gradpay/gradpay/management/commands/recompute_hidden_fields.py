@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from gradpay.models import Survey
+
+
+class Command(NoArgsCommand):
+
+    help = 'Rebuild auto-generated survey fields'
+
+    def handle_noargs(self, **options):
+        Survey.objects.recompute_hidden_fields()
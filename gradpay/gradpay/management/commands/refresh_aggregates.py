@@ -0,0 +1,12 @@
+from django.core.management.base import NoArgsCommand
+
+from gradpay.models import SurveyAggregate
+
+
+class Command(NoArgsCommand):
+
+    help = 'Rebuild precomputed survey aggregates'
+
+    def handle_noargs(self, **options):
+        count = SurveyAggregate.objects.refresh()
+        self.stdout.write('Wrote %d aggregate rows\n' % count)
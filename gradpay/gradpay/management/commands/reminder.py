@@ -1,3 +1,6 @@
+import time
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 
 from gradpay.models import Survey
@@ -5,7 +8,36 @@ from gradpay.models import Survey
 
 class Command(NoArgsCommand):
 
-    help = 'Delete expired surveys'
+    help = 'Send activation reminders'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=50,
+            help='Number of emails to send per mail backend connection',
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of concurrent senders',
+        ),
+    )
 
     def handle_noargs(self, **options):
-        Survey.objects.send_reminders()
+
+        start = time.time()
+        sent = Survey.objects.send_reminders(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+        )
+        elapsed = time.time() - start
+
+        self.stdout.write(
+            'Sent %d reminders in %.2fs (%.1f/s)\n' % (
+                sent, elapsed, sent / elapsed if elapsed else 0
+            )
+        )
@@ -0,0 +1,46 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from gradpay.models import QueuedEmail
+
+
+class Command(NoArgsCommand):
+
+    help = 'Send queued emails'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=50,
+            help='Number of emails to send per mail backend connection',
+        ),
+        make_option(
+            '--loop',
+            action='store_true',
+            dest='loop',
+            default=False,
+            help='Keep polling the queue instead of exiting when it is empty',
+        ),
+        make_option(
+            '--interval',
+            type='float',
+            dest='interval',
+            default=5,
+            help='Seconds to wait between polls when the queue is empty',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        while True:
+            sent, failed = QueuedEmail.objects.send_batch(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Sent %d emails, %d failed\n' % (sent, failed))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
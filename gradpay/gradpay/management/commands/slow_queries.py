@@ -0,0 +1,63 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from gradpay import slowlog
+
+
+class Command(NoArgsCommand):
+
+    help = 'Summarize the slow query log by view and query shape'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--log',
+            dest='log',
+            default=None,
+            help='Slow query log [default: SLOW_QUERY_LOG]',
+        ),
+        make_option(
+            '--view',
+            dest='view',
+            default=None,
+            help='Only summarize queries from this view',
+        ),
+        make_option(
+            '--top',
+            type='int',
+            dest='top',
+            default=10,
+            help='Number of shapes to show',
+        ),
+        make_option(
+            '--no-plans',
+            action='store_false',
+            dest='plans',
+            default=True,
+            help="Don't show the plan of each shape's slowest query",
+        ),
+    )
+
+    def handle_noargs(self, **options):
+
+        summaries = slowlog.summarize(
+            slowlog.read_log(options['log']), options['view']
+        )
+        if not summaries:
+            self.stdout.write('No slow queries logged\n')
+            return
+
+        for summary in summaries[:options['top']]:
+            worst = summary.worst
+            self.stdout.write(
+                '%s  %s\n'
+                '  %d queries, %.3fs total, %.3fs mean, %.3fs max\n' % (
+                    summary.view, summary.shape or '(no shape)',
+                    summary.count, summary.seconds, summary.mean, worst['seconds'],
+                )
+            )
+            self.stdout.write('  %s\n' % (worst['sql'].encode('utf-8')))
+            if options['plans'] and worst.get('plan'):
+                for line in worst['plan']:
+                    self.stdout.write('    %s\n' % (line.encode('utf-8')))
+            self.stdout.write('\n')
@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from gradpay.models import Survey
+
+
+class Command(NoArgsCommand):
+
+    help = 'Rebuild survey degree masks from the degree table'
+
+    def handle_noargs(self, **options):
+        Survey.objects.update_degree_masks()
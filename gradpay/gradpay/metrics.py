@@ -0,0 +1,304 @@
+'''
+Per-view request metrics kept in process: latency histograms, SQL query
+counts and time, and response sizes, by URL name. The metrics view
+renders them in the Prometheus text format.
+
+Counters belong to one process; with several workers, each scrape sees
+the worker that answered it.
+'''
+
+import time
+import threading
+
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connections
+
+import slowlog
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Label for requests that never reach a view
+UNMATCHED = 'unmatched'
+
+
+class _RequestState(threading.local):
+    """ SQL work done by the current thread's request. """
+
+    label = None
+    queries = 0
+    sql_seconds = 0.0
+
+
+_state = _RequestState()
+
+
+class TimedCursor(object):
+    """ Cursor wrapper adding each query's time to the request state,
+    and passing queries to the slow query log. """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            result = self.cursor.execute(sql, params)
+        finally:
+            seconds = time.time() - start
+            _state.queries += 1
+            _state.sql_seconds += seconds
+        # Only queries that succeeded: explaining a failed one would fail
+        # again, or in an aborted transaction
+        slowlog.log_query(self.connection, sql, params, seconds, _state.label)
+        return result
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            _state.queries += 1
+            _state.sql_seconds += time.time() - start
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def instrument(connection):
+    """ Time the queries run through `connection`. The connection's own
+    cursor() still decides whether queries are logged, so DEBUG and
+    assertNumQueries behave as before. """
+
+    if getattr(connection, 'metrics_instrumented', False):
+        return
+    cursor = connection.cursor
+    connection.cursor = lambda: TimedCursor(cursor(), connection)
+    connection.metrics_instrumented = True
+
+
+class ViewStats(object):
+
+    def __init__(self):
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.bytes = 0
+
+
+class Registry(object):
+    """ Thread-safe counters by view label. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.started = time.time()
+
+    def _stats(self, label):
+        stats = self.views.get(label)
+        if stats is None:
+            stats = self.views[label] = ViewStats()
+        return stats
+
+    def record(self, label, status, seconds, queries, sql_seconds, size):
+
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        with self.lock:
+            stats = self._stats(label)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.buckets[bucket] += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.bytes += size
+
+    def add_stream(self, label, queries, sql_seconds, size):
+        """ Add work done while a streamed response was sent. """
+
+        with self.lock:
+            stats = self._stats(label)
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.bytes += size
+
+    def snapshot(self):
+        """ Copies of the counters, by label. """
+
+        with self.lock:
+            views = {}
+            for label, stats in self.views.items():
+                copy = ViewStats()
+                copy.__dict__.update(stats.__dict__)
+                copy.statuses = dict(stats.statuses)
+                copy.buckets = list(stats.buckets)
+                views[label] = copy
+            return views
+
+    def reset(self):
+
+        with self.lock:
+            self.views = {}
+
+
+registry = Registry()
+
+
+def _escape(value):
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, _escape(str(value)))
+        for name, value in sorted(labels.items())
+    )
+
+
+def _number(value):
+
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(registry=registry):
+    """ The counters in the Prometheus text exposition format. """
+
+    views = sorted(registry.snapshot().items())
+    lines = []
+
+    def family(name, kind, description, samples):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append('%s%s%s %s' % (name, suffix, _labels(**labels), _number(value)))
+
+    family(
+        'gradpay_http_requests_total', 'counter',
+        'Requests by view and response status.',
+        [('', {'view': label, 'status': status}, count)
+         for label, stats in views
+         for status, count in sorted(stats.statuses.items())],
+    )
+
+    samples = []
+    for label, stats in views:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+            cumulative += count
+            samples.append(('_bucket', {'view': label, 'le': bound}, cumulative))
+        samples.append(('_sum', {'view': label}, stats.seconds))
+        samples.append(('_count', {'view': label}, cumulative))
+    family(
+        'gradpay_http_request_duration_seconds', 'histogram',
+        'Time from request to response by view.', samples,
+    )
+
+    family(
+        'gradpay_db_queries_total', 'counter',
+        'SQL queries run by view.',
+        [('', {'view': label}, stats.queries) for label, stats in views],
+    )
+    family(
+        'gradpay_db_query_duration_seconds_total', 'counter',
+        'Time spent in SQL queries by view.',
+        [('', {'view': label}, stats.sql_seconds) for label, stats in views],
+    )
+    family(
+        'gradpay_http_response_bytes_total', 'counter',
+        'Response body bytes by view.',
+        [('', {'view': label}, stats.bytes) for label, stats in views],
+    )
+    family(
+        'gradpay_process_start_time_seconds', 'gauge',
+        'Start time of this process since the epoch.',
+        [('', {}, registry.started)],
+    )
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware(object):
+    """
+    Record each request's latency, SQL queries and response size under
+    the name of the URL pattern it matched, falling back to the view's
+    name for unnamed patterns. Put it first so its timing covers the
+    other middleware.
+    """
+
+    def __init__(self):
+        self.labels = {}
+
+    def process_request(self, request):
+
+        for connection in connections.all():
+            instrument(connection)
+        _state.label = None
+        _state.queries = 0
+        _state.sql_seconds = 0.0
+        slowlog.clear_shape()
+        request._metrics_start = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+
+        label = self.labels.get(view_func)
+        if label is None:
+            label = self.view_label(request, view_func)
+            self.labels[view_func] = label
+        request._metrics_label = _state.label = label
+
+    def view_label(self, request, view_func):
+
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            url_name = None
+        return url_name or getattr(view_func, '__name__', UNMATCHED)
+
+    def process_response(self, request, response):
+
+        start = getattr(request, '_metrics_start', None)
+        if start is None:
+            return response
+        label = getattr(request, '_metrics_label', UNMATCHED)
+
+        # Streamed bodies, and the queries feeding them, are counted as
+        # they are sent
+        if response._base_content_is_iter:
+            response._container = self.count_stream(label, response._container)
+            size = 0
+        else:
+            size = len(response.content)
+
+        registry.record(
+            label, response.status_code, time.time() - start,
+            _state.queries, _state.sql_seconds, size,
+        )
+        return response
+
+    def count_stream(self, label, chunks):
+
+        queries, sql_seconds = _state.queries, _state.sql_seconds
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            registry.add_stream(
+                label, _state.queries - queries,
+                _state.sql_seconds - sql_seconds, size,
+            )
@@ -1,12 +1,17 @@
+import time
 import datetime
+import itertools
 
-from django.db import models
+from django.core import mail
+from django.core.cache import cache
+from django.db import models, transaction
 from django.utils.timezone import now
 from django.core.validators import MinValueValidator
 
 import choices
 import settings
 import activation
+import aggregates
 
 
 class Department(models.Model):
@@ -14,7 +19,7 @@ class Department(models.Model):
     Field of study.
     """
 
-    name = models.CharField(max_length=256)
+    name = models.CharField(max_length=256, db_index=True)
 
     def __unicode__(self):
         return self.name
@@ -27,17 +32,59 @@ class Institution(models.Model):
 
     name = models.CharField(max_length=256)
     city = models.CharField(max_length=256)
-    state = models.CharField(max_length=256)
+    state = models.CharField(max_length=256, db_index=True)
     category = models.CharField(max_length=256)
 
     county = models.CharField(max_length=256)
-    county_code = models.CharField(max_length=5)
-    state_code = models.CharField(max_length=2)
+    county_code = models.CharField(max_length=5, db_index=True)
+    state_code = models.CharField(max_length=2, db_index=True)
 
     def __unicode__(self):
         return self.name
 
 
+class ReferenceManager(models.Manager):
+    """
+    Manager for small reference tables whose rows are looked up once per
+    process. The cache is cleared when a row is saved or deleted in this
+    process; other processes keep their copies until restarted.
+    """
+
+    def get_cached(self, **kwargs):
+
+        cache = _reference_cache.setdefault(self.model, {})
+        key = tuple(sorted(kwargs.items()))
+        if key not in cache:
+            cache[key] = self.get(**kwargs)
+        return cache[key]
+
+
+_reference_cache = {}
+
+
+def clear_reference_cache(sender, **kwargs):
+
+    _reference_cache.pop(sender, None)
+
+
+class DegreeManager(ReferenceManager):
+
+    def phd_id(self):
+        """ Primary key of the PhD degree. """
+
+        return self.get_cached(name__contains='PhD').pk
+
+
+class SupportManager(ReferenceManager):
+
+    def fellowship_id(self):
+        """ Primary key of the fellowship support type. """
+
+        return self.get_cached(
+            name='Competitive grant/fellowship to student'
+        ).pk
+
+
 class Degree(models.Model):
     """
     Degree.
@@ -45,6 +92,12 @@ class Degree(models.Model):
 
     name = models.CharField(max_length=256)
 
+    objects = DegreeManager()
+
+    @property
+    def bit(self):
+        return degree_bit(self.pk)
+
     def __unicode__(self):
         return self.name
 
@@ -57,24 +110,309 @@ class Support(models.Model):
     name = models.CharField(max_length=64)
     tooltip = models.CharField(max_length=256)
 
+    objects = SupportManager()
+
     def __unicode__(self):
         return self.name
 
 
+for model in [Degree, Support]:
+    models.signals.post_save.connect(clear_reference_cache, sender=model)
+    models.signals.post_delete.connect(clear_reference_cache, sender=model)
+
+
+# Bits of Survey.degree_mask; degree keys must stay below this to fit
+DEGREE_MASK_BITS = 31
+
+
+def degree_bit(pk):
+    """ Bit for a degree in Survey.degree_mask. """
+
+    return 1 << pk
+
+
+# Survey flag columns and the choice fields they are derived from
+HIDDEN_FLAGS = (
+    ('_has_student_loans', 'student_loans'),
+    ('_has_part_time_work', 'part_time_work'),
+    ('_is_union_member', 'union_member'),
+)
+
+
+def degree_ids(mask):
+    """ Degree keys whose bits are set in a degree mask. """
+
+    return [pk for pk in range(DEGREE_MASK_BITS) if mask & degree_bit(pk)]
+
+
+class QueuedEmailManager(models.Manager):
+
+    def enqueue(self, message):
+        """ Queue an EmailMessage for the send_mail_queue worker. """
+
+        return self.create(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            recipients=','.join(message.recipients()),
+        )
+
+    @transaction.commit_on_success
+    def _claim(self, batch_size):
+        """ Lock a batch of due messages and push back their next
+        attempt so concurrent workers skip them. """
+
+        due = list(
+            self.select_for_update().filter(
+                sent__isnull=True,
+                attempts__lt=settings.MAIL_QUEUE_MAX_ATTEMPTS,
+                next_attempt__lte=now(),
+            ).order_by('next_attempt')[:batch_size]
+        )
+        lease = datetime.timedelta(seconds=settings.MAIL_QUEUE_LEASE_SECONDS)
+        self.filter(
+            pk__in=[queued.pk for queued in due]
+        ).update(next_attempt=now() + lease)
+        return due
+
+    def send_batch(self, batch_size=50):
+        """ Send up to `batch_size` due messages over one connection.
+        Failed messages are retried with exponential backoff. Returns
+        the numbers of messages sent and failed. """
+
+        due = self._claim(batch_size)
+        if not due:
+            return 0, 0
+
+        # A connection failure fails every claimed message, which is
+        # retried like any other failed send
+        connection = mail.get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            for queued in due:
+                queued.failed(error)
+            return 0, len(due)
+
+        sent = failed = 0
+        try:
+            for queued in due:
+                try:
+                    connection.send_messages([queued.to_message()])
+                except Exception as error:
+                    queued.failed(error)
+                    failed += 1
+                else:
+                    queued.sent = now()
+                    queued.save()
+                    sent += 1
+        finally:
+            connection.close()
+
+        return sent, failed
+
+
+class QueuedEmail(models.Model):
+    """
+    Outbound email waiting to be sent by the send_mail_queue worker.
+    """
+
+    subject = models.CharField(max_length=256)
+    body = models.TextField()
+    from_email = models.CharField(max_length=256)
+    recipients = models.TextField()
+
+    time_created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=now, db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, db_index=True)
+
+    objects = QueuedEmailManager()
+
+    def to_message(self):
+
+        return mail.EmailMessage(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.recipients.split(','),
+        )
+
+    def failed(self, error):
+        """ Record a failed attempt and schedule the next one. """
+
+        self.attempts += 1
+        self.last_error = repr(error)
+        delay = settings.MAIL_QUEUE_RETRY_SECONDS * 2 ** (self.attempts - 1)
+        self.next_attempt = now() + datetime.timedelta(seconds=delay)
+        self.save()
+
+
 class SurveyManager(models.Manager):
 
-    def delete_expired_surveys(self):
+    def with_degree(self, degree_id):
+        """ Surveys for a degree, filtered on degree_mask without
+        joining the degree table. """
+
+        return self.extra(
+            where=['degree_mask & %s != 0'],
+            params=[degree_bit(degree_id)],
+        )
+
+    @transaction.commit_on_success
+    def update_degree_masks(self):
+        """ Rebuild degree_mask for all surveys, one UPDATE per degree,
+        and the aggregates built from it. """
+
+        self._update_degree_masks()
+        SurveyAggregate.objects.rebuild()
+
+    def _update_degree_masks(self):
+        """ Rebuild degree masks in the caller's transaction. """
+
+        self.update(degree_mask=0)
+        for degree in Degree.objects.all():
+            self.filter(
+                degree=degree
+            ).update(degree_mask=models.F('degree_mask') + degree.bit)
+        bump_survey_version()
 
-        for survey in self.all():
-            if not survey.is_active:
-                delta = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
-                if (survey.time_created + delta) < now():
-                    survey.delete()
+    @transaction.commit_on_success
+    def recompute_hidden_fields(self):
+        """ Rebuild the auto-generated fields of all surveys with
+        set-based UPDATEs, and the aggregates built from them. """
 
-    def send_reminders(self):
+        self.update(
+            _teaching_fraction=models.F('teaching_terms') * 1.0 / models.F('total_terms')
+        )
+
+        for flag, field in HIDDEN_FLAGS:
+            self.filter(**{field: 'YS'}).update(**{flag: 1})
+            self.exclude(**{field: 'YS'}).update(**{flag: 0})
+
+        self.update(_has_fellowship=0)
+        self.filter(
+            support_types=Support.objects.fellowship_id()
+        ).update(_has_fellowship=1)
+
+        # Undecorated, so the whole rebuild commits once
+        self._update_degree_masks()
+        SurveyAggregate.objects.rebuild()
+
+    def activate(self, key):
+        """ Activate the survey with activation key `key`, deleting
+        other surveys with its email address, and return it; None if no
+        survey has the key. Surveys sharing the address are locked in
+        primary key order for the whole transaction, so concurrent
+        activations of the same key or address run one after another,
+        and only the first activation of a key succeeds. Aggregate rows
+        are then locked in key order, so activations for different
+        addresses can't deadlock on them. """
+
+        emails = self.filter(activation_key=key).values_list('email', flat=True)[:1]
+        if not emails:
+            return None
+
+        with transaction.commit_on_success():
+            surveys = list(
+                self.select_for_update().filter(email=emails[0]).order_by('pk')
+            )
+            matches = [survey for survey in surveys if survey.activation_key == key]
+            if not matches:
+                return None
+            survey = matches[0]
+
+            # Delete users w/ same email
+            duplicates = self.filter(
+                pk__in=[other.pk for other in surveys if other.pk != survey.pk]
+            )
+            deltas = SurveyAggregate.objects.collect_deltas(duplicates, -1)
+            duplicates.delete()
+
+            # Activate target survey
+            survey.is_active = True
+            survey.activation_key = 'ACTIVATED'
+            survey.save()
+
+            # Update aggregates in one pass, locking rows in key order
+            SurveyAggregate.objects.collect_deltas(
+                self.filter(pk=survey.pk), 1, deltas
+            )
+            SurveyAggregate.objects.apply_deltas(deltas)
+
+        return survey
+
+    def expired_surveys(self):
+        """ Surveys not activated within the activation window. """
+
+        delta = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        return self.filter(is_active=False, time_created__lt=now() - delta)
+
+    @transaction.commit_on_success
+    def _delete_batch(self, pks):
+        """ Delete the surveys in `pks` that are still expired, returning
+        how many were deleted. They are locked and checked again, as
+        activate locks them, so a survey activated since `pks` was read
+        is kept. """
+
+        pks = list(
+            self.expired_surveys().select_for_update().filter(
+                pk__in=pks
+            ).values_list('pk', flat=True)
+        )
+        self.filter(pk__in=pks).delete()
+        return len(pks)
+
+    def delete_expired_surveys(self, batch_size=1000, progress=None):
+        """ Delete expired surveys in batches of at most `batch_size`,
+        calling `progress(deleted, total)` after each batch. Returns the
+        number of surveys deleted. """
+
+        # Only inactive surveys expire, and those are never counted
+        # in SurveyAggregate, so aggregates need no update here
+        expired = self.expired_surveys()
+        total = expired.count()
+        deleted = 0
+
+        while True:
+            pks = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += self._delete_batch(pks)
+            if progress is not None:
+                progress(deleted, total)
+
+        return deleted
+
+    def send_reminders(self, chunk_size=50, workers=4):
+        """ Remind inactive surveys to activate, skipping addresses
+        reminded within REMINDER_INTERVAL_DAYS. Returns the number of
+        reminders sent. """
+
+        delta = datetime.timedelta(days=settings.REMINDER_INTERVAL_DAYS)
+        recent = self.filter(last_reminded__gte=now() - delta).values('email')
+        surveys = self.filter(
+            is_active=False
+        ).exclude(
+            activation_key='ACTIVATED'
+        ).exclude(
+            email__in=recent
+        )
+
+        sent = 0
+        chunks = activation.send_activation_emails(
+            surveys,
+            chunk_size=chunk_size,
+            workers=workers,
+        )
+        for chunk in chunks:
+            self.filter(
+                pk__in=[survey.pk for survey in chunk]
+            ).update(last_reminded=now())
+            sent += len(chunk)
 
-        for survey in self.filter(is_active=False).exclude(activation_key='ACTIVATED'):
-            activation.send_activation_email(survey)
+        return sent
 
 
 class Survey(models.Model):
@@ -85,11 +423,13 @@ class Survey(models.Model):
 
     # Activation fields
     is_active = models.BooleanField(editable=False)
-    activation_key = models.CharField(max_length=40, editable=False)
+    activation_key = models.CharField(max_length=40, editable=False, db_index=True)
+    last_reminded = models.DateTimeField(null=True, editable=False)
 
     # Email address
     email = models.EmailField(
         max_length=70,
+        db_index=True,
         verbose_name='Email address',
         help_text='Note: You must use an academic [.edu] email address.',
     )
@@ -104,6 +444,8 @@ class Survey(models.Model):
         Degree,
         help_text='Which degree(s) are you pursuing? Check all that apply.',
     )
+    # Bits from degree_bit() for each degree, kept by save_hidden
+    degree_mask = models.IntegerField(default=0, editable=False, db_index=True)
     start_year = models.IntegerField(help_text='Year you began your program [yyyy].')
     graduation_year = models.IntegerField(
         help_text='Year of (expected) graduation [yyyy].',
@@ -294,15 +636,346 @@ class Survey(models.Model):
 
     objects = SurveyManager()
 
-    def save_hidden(self):
-        """ Update auto-generated fields. """
+    def set_hidden(self, support_ids, degree_ids):
+        """ Compute auto-generated fields, given the keys of the survey's
+        support types and degrees. Does not save. """
 
         self._teaching_fraction = self.teaching_terms / float(self.total_terms)
-        self._has_student_loans = int(self.student_loans == 'YS')
-        self._has_part_time_work = int(self.part_time_work == 'YS')
-        self._is_union_member = int(self.union_member == 'YS')
+        for flag, field in HIDDEN_FLAGS:
+            setattr(self, flag, int(getattr(self, field) == 'YS'))
+
+        self.degree_mask = sum(degree_bit(pk) for pk in set(degree_ids))
+        self._has_fellowship = int(
+            Support.objects.fellowship_id() in set(support_ids)
+        )
 
-        fellowship = Support.objects.get(name='Competitive grant/fellowship to student')
-        self._has_fellowship = int(fellowship in self.support_types.all())
+    def save_hidden(self):
+        """ Update auto-generated fields from saved relations. """
+
+        self.set_hidden(
+            self.support_types.values_list('pk', flat=True),
+            self.degree.values_list('pk', flat=True),
+        )
 
         super(Survey, self).save()
+
+
+SURVEY_VERSION_KEY = 'gradpay:survey_version'
+
+
+def survey_version():
+    """ Version of the survey data, for keying cached results. Bumped
+    when surveys change in this process; the key expires after
+    SURVEY_VERSION_TTL seconds, bounding staleness when the cache is
+    not shared between processes. """
+
+    version = cache.get(SURVEY_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(SURVEY_VERSION_KEY, version, settings.SURVEY_VERSION_TTL)
+        version = cache.get(SURVEY_VERSION_KEY, version)
+    return version
+
+
+def bump_survey_version(*args, **kwargs):
+
+    try:
+        cache.incr(SURVEY_VERSION_KEY)
+    except ValueError:
+        survey_version()
+
+models.signals.post_save.connect(bump_survey_version, sender=Survey)
+models.signals.post_delete.connect(bump_survey_version, sender=Survey)
+
+
+def home_counts():
+    """ Numbers of active responses, institutions and departments, as
+    n_resp, n_inst and n_dept. Cached by survey version, so they are
+    counted again after surveys are activated or deleted. """
+
+    key = 'gradpay:home_counts:%s' % (survey_version())
+    counts = cache.get(key)
+    if counts is None:
+        counts = Survey.objects.filter(is_active=True).aggregate(
+            n_resp=models.Count('id'),
+            n_inst=models.Count('institution', distinct=True),
+            n_dept=models.Count('department', distinct=True),
+        )
+        cache.set(key, counts, settings.HOME_COUNTS_CACHE_SECONDS)
+    return counts
+
+
+# Aggregate columns and the Survey fields they are grouped on
+AGGREGATE_GROUPS = (
+    ('institution', 'institution__name'),
+    ('state', 'institution__state'),
+    ('state_code', 'institution__state_code'),
+    ('county_code', 'institution__county_code'),
+    ('department', 'department__name'),
+)
+
+# Survey fields summarized in each aggregate row
+AGGREGATE_METRICS = (
+    'stipend',
+    '_teaching_fraction',
+    '_has_student_loans',
+    '_has_part_time_work',
+    '_has_fellowship',
+)
+
+# Every combination of grouping columns that gets its own rows
+AGGREGATE_GROUPINGS = [
+    grouping
+    for size in range(1, len(AGGREGATE_GROUPS) + 1)
+    for grouping in itertools.combinations(
+        [column for column, _ in AGGREGATE_GROUPS], size
+    )
+]
+
+
+def grouping_key(columns):
+    """ Canonical key for a combination of grouping columns. """
+
+    return ','.join(
+        column for column, _ in AGGREGATE_GROUPS
+        if column in columns
+    )
+
+
+class SurveyAggregateManager(models.Manager):
+
+    def for_grouping(self, columns, degree_id):
+
+        return self.filter(
+            grouping=grouping_key(columns),
+            degree=degree_id,
+        ).order_by(
+            *[column for column, _ in AGGREGATE_GROUPS if column in columns]
+        )
+
+    def _counted_surveys(self, surveys):
+        """ Degree masks, group values and metrics of the surveys that
+        contribute to aggregates: activated responses with a degree. """
+
+        return surveys.filter(
+            is_active=True,
+        ).exclude(
+            degree_mask=0,
+        ).values_list(
+            *['degree_mask'] + [field for _, field in AGGREGATE_GROUPS] +
+            list(AGGREGATE_METRICS)
+        )
+
+    @transaction.commit_on_success
+    def refresh(self):
+        """ Rebuild all aggregate rows from activated surveys. """
+
+        return self.rebuild()
+
+    def rebuild(self):
+        """ Rebuild all aggregate rows in the caller's transaction. """
+
+        columns = [column for column, _ in AGGREGATE_GROUPS]
+
+        # Single pass over surveys, bucketed by degree and the finest grouping
+        buckets = {}
+        for survey in self._counted_surveys(Survey.objects):
+            values = survey[1:len(columns) + 1]
+            for degree_id in degree_ids(survey[0]):
+                if (degree_id, values) not in buckets:
+                    buckets[(degree_id, values)] = self.model()
+                buckets[(degree_id, values)].add(survey[len(columns) + 1:])
+
+        # Merge buckets for every combination of grouping columns
+        records = []
+        for grouping in AGGREGATE_GROUPINGS:
+            groups = {}
+            for (degree_id, values), bucket in buckets.iteritems():
+                key = dict(
+                    (column, value)
+                    for column, value in zip(columns, values)
+                    if column in grouping
+                )
+                key['degree_id'] = degree_id
+                group = tuple(sorted(key.items()))
+                if group not in groups:
+                    groups[group] = self.model(
+                        grouping=grouping_key(grouping), **key
+                    )
+                groups[group].merge(bucket)
+            records.extend(groups.values())
+
+        for record in records:
+            record.update_stats()
+
+        # Swap in the new rows
+        self.all().delete()
+        self.bulk_create(records)
+
+        return len(records)
+
+    def collect_deltas(self, surveys, weight, deltas=None):
+        """ Changes adding (weight 1) or removing (weight -1) surveys
+        make to the aggregate rows, added to `deltas`: a dict from row
+        key to a list of (metrics, weight) pairs. """
+
+        columns = [column for column, _ in AGGREGATE_GROUPS]
+        if deltas is None:
+            deltas = {}
+
+        for survey in self._counted_surveys(surveys):
+            values = survey[1:len(columns) + 1]
+            metrics = survey[len(columns) + 1:]
+            for degree_id in degree_ids(survey[0]):
+                for grouping in AGGREGATE_GROUPINGS:
+                    key = (degree_id, grouping_key(grouping)) + tuple(
+                        value if column in grouping else ''
+                        for column, value in zip(columns, values)
+                    )
+                    deltas.setdefault(key, []).append((metrics, weight))
+        return deltas
+
+    def apply_deltas(self, deltas):
+        """ Apply collected changes in the caller's transaction. Rows are
+        locked in key order, so transactions touching the same rows
+        wait for each other instead of deadlocking. """
+
+        columns = [column for column, _ in AGGREGATE_GROUPS]
+
+        for key in sorted(deltas):
+            # Look rows up by their full, unique key; if another
+            # transaction inserts the row first, get_or_create rolls
+            # back to a savepoint and gets that row
+            record, _ = self.select_for_update().get_or_create(
+                degree_id=key[0],
+                grouping=key[1],
+                **dict(zip(columns, key[2:]))
+            )
+            for metrics, weight in deltas[key]:
+                record.add(metrics, weight)
+            if record.num_resp > 0:
+                record.update_stats()
+                record.save()
+            else:
+                record.delete()
+
+
+class SurveyAggregate(models.Model):
+    """
+    Statistics for activated surveys, one row per degree and combination
+    of grouping values. Columns outside the grouping are left blank.
+
+    Each row keeps running state (counts, sums and a stipend sketch) so
+    it can be updated in place as surveys are activated or deleted. All
+    statistics are exact except the stipend median and percentiles,
+    which are estimated from the sketch to within
+    ``aggregates.SKETCH_ACCURACY`` relative error of the exact values.
+    """
+
+    grouping = models.CharField(max_length=64, db_index=True)
+    degree = models.ForeignKey(Degree)
+
+    # Grouping values
+    institution = models.CharField(max_length=256, blank=True)
+    state = models.CharField(max_length=256, blank=True)
+    state_code = models.CharField(max_length=2, blank=True)
+    county_code = models.CharField(max_length=5, blank=True)
+    department = models.CharField(max_length=256, blank=True)
+
+    # Running state
+    num_resp = models.IntegerField(default=0)
+    sum_teach_frac = models.FloatField(default=0)
+    sum_student_loans = models.IntegerField(default=0)
+    sum_part_time_work = models.IntegerField(default=0)
+    sum_fellowship = models.IntegerField(default=0)
+    stipend_sketch = models.TextField(default='{}')
+
+    # Statistics
+    avg_stipend = models.FloatField(null=True)
+    stipend_p10 = models.FloatField(null=True)
+    stipend_p25 = models.FloatField(null=True)
+    stipend_p75 = models.FloatField(null=True)
+    stipend_p90 = models.FloatField(null=True)
+    avg_teach_frac = models.FloatField(null=True)
+    _has_student_loans = models.FloatField(null=True)
+    _has_part_time_work = models.FloatField(null=True)
+    _has_fellowship = models.FloatField(null=True)
+
+    objects = SurveyAggregateManager()
+
+    @property
+    def sketch(self):
+        if not hasattr(self, '_sketch'):
+            self._sketch = aggregates.QuantileSketch.loads(self.stipend_sketch)
+        return self._sketch
+
+    def add(self, metrics, weight=1):
+        """ Add (or with negative weight, remove) one survey's metrics,
+        ordered as in AGGREGATE_METRICS. """
+
+        stipend, teach_frac, loans, part_time_work, fellowship = metrics
+        self.num_resp += weight
+        self.sum_teach_frac += weight * teach_frac
+        self.sum_student_loans += weight * loans
+        self.sum_part_time_work += weight * part_time_work
+        self.sum_fellowship += weight * fellowship
+        self.sketch.add(stipend, weight)
+
+    def merge(self, other):
+
+        self.num_resp += other.num_resp
+        self.sum_teach_frac += other.sum_teach_frac
+        self.sum_student_loans += other.sum_student_loans
+        self.sum_part_time_work += other.sum_part_time_work
+        self.sum_fellowship += other.sum_fellowship
+        self.sketch.merge(other.sketch)
+
+    def update_stats(self):
+        """ Recompute statistics from running state. """
+
+        self.stipend_sketch = self.sketch.dumps()
+
+        self.avg_stipend = self.sketch.median()
+        self.stipend_p10 = self.sketch.percentile(0.1)
+        self.stipend_p25 = self.sketch.percentile(0.25)
+        self.stipend_p75 = self.sketch.percentile(0.75)
+        self.stipend_p90 = self.sketch.percentile(0.9)
+
+        if not self.num_resp:
+            self.avg_teach_frac = None
+            self._has_student_loans = self._has_part_time_work = None
+            self._has_fellowship = None
+            return
+
+        num_resp = float(self.num_resp)
+        self.avg_teach_frac = self.sum_teach_frac / num_resp
+        self._has_student_loans = self.sum_student_loans / num_resp
+        self._has_part_time_work = self.sum_part_time_work / num_resp
+        self._has_fellowship = self.sum_fellowship / num_resp
+
+
+# Fields added to models whose tables already exist, as (model, field
+# name); syncdb won't add their columns, the add_columns command does
+ADDED_COLUMNS = (
+    (Survey, 'last_reminded'),
+    # Filled in by update_degree_masks
+    (Survey, 'degree_mask'),
+)
+
+
+# Indexes over several columns, which models can't declare, as (model,
+# index name, field names, unique); created by the create_indexes command
+COMPOSITE_INDEXES = (
+    # One row per degree and group, so concurrent activations can't both
+    # insert a group's first row; incremental updates look rows up by it
+    (SurveyAggregate, 'gradpay_surveyaggregate_group',
+     ('degree', 'grouping') + tuple(column for column, _ in AGGREGATE_GROUPS),
+     True),
+    # The results, map, scatter and API views select rows of a grouping
+    # with a minimum response count
+    (SurveyAggregate, 'gradpay_surveyaggregate_rows',
+     ('degree', 'grouping', 'num_resp'), False),
+    # Home page counts and stipend histograms read active stipends,
+    # which this index covers
+    (Survey, 'gradpay_survey_active_stipend', ('is_active', 'stipend'), False),
+)
@@ -0,0 +1,138 @@
+'''
+Query plan checks: run the analytics views against the current database,
+EXPLAIN each SELECT they issue, and report the queries that read a large
+table sequentially, so lost or unused indexes show up before the tables
+grow. The test suite runs them on seeded data; the check_query_plans
+command runs them read-only against a live database.
+'''
+
+import re
+
+from django.core.cache import cache
+from django.db import connections
+from django.test.client import Client
+
+from benchmark import BENCHMARK_VIEWS
+from models import Survey, SurveyAggregate
+from slowlog import explain
+
+
+# Views whose queries must use indexes, by benchmark view name
+PLAN_VIEWS = (
+    'results_json',
+    'results_json_search',
+    'scatter_json',
+    'choro_json_state',
+    'choro_json_county',
+    'stipend_histogram',
+    'api_institution',
+)
+
+# Tables that grow with responses; the reference tables are small
+# enough to scan
+LARGE_TABLES = (Survey._meta.db_table, SurveyAggregate._meta.db_table)
+
+# Plan lines reading a whole table, by backend; sqlite reports an index
+# scan as SCAN ... USING INDEX, which is allowed
+SCAN_RES = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'^SCAN (?:TABLE )?(\w+)$'),
+}
+
+# Views allowed to read a large table whole, by backend. The stipend
+# histogram reads most active stipends, which PostgreSQL rightly does
+# with a Seq Scan; SQLite reads them from the covering index
+SCAN_VIEWS = {
+    'postgresql': ('stipend_histogram',),
+}
+
+
+class CapturingCursor(object):
+    """ Cursor wrapper recording the SQL and parameters it executes. """
+
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+    def execute(self, sql, params=()):
+        self.queries.append((sql, params))
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def view_queries(client, path, params, using='default'):
+    """ SQL and parameters of the queries a request runs, on a cold
+    cache. """
+
+    connection = connections[using]
+    queries = []
+    # Restore whatever cursor method the connection had, which may be
+    # the metrics middleware's wrapper
+    previous = connection.__dict__.get('cursor')
+    cursor = connection.cursor
+    connection.cursor = lambda: CapturingCursor(cursor(), queries)
+    try:
+        cache.clear()
+        response = client.get(path, params)
+        ''.join(response)
+    finally:
+        if previous is None:
+            del connection.cursor
+        else:
+            connection.cursor = previous
+    if response.status_code != 200:
+        raise RuntimeError('%s returned %d' % (path, response.status_code))
+    return queries
+
+
+def sequential_scans(vendor, plan):
+    """ Large tables read whole by a plan. """
+
+    pattern = SCAN_RES[vendor]
+    scans = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) in LARGE_TABLES:
+            scans.append(match.group(1))
+    return scans
+
+
+def check_plans(views=PLAN_VIEWS, using='default'):
+    """ Plans of the SELECTs each view runs, as (view, sql, params, plan,
+    scans) tuples; a query is a regression if scans is not empty. """
+
+    connection = connections[using]
+    if connection.vendor not in SCAN_RES:
+        raise NotImplementedError('Plan checks not supported on %s' % (connection.vendor))
+
+    client = Client()
+    paths = dict((name, (path, params)) for name, path, params in BENCHMARK_VIEWS)
+    results = []
+    for name in views:
+        path, params = paths[name]
+        for sql, params in view_queries(client, path, params, using):
+            plan = explain(connection, sql, params)
+            if plan is None:
+                continue
+            scans = []
+            if name not in SCAN_VIEWS.get(connection.vendor, ()):
+                scans = sequential_scans(connection.vendor, plan)
+            results.append((name, sql, params, plan, scans))
+    return results
+
+
+def analyze(using='default'):
+    """ Refresh the planner's statistics, so plans reflect the data. """
+
+    connection = connections[using]
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        for table in LARGE_TABLES:
+            cursor.execute('ANALYZE %s' % (connection.ops.quote_name(table)))
+    elif connection.vendor == 'sqlite':
+        cursor.execute('ANALYZE')
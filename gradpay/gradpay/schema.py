@@ -0,0 +1,73 @@
+'''
+Add the columns listed in models.ADDED_COLUMNS to tables created before
+those fields existed. syncdb only creates missing tables and never
+alters existing ones, so these are added with the add_columns command,
+which must run before anything reads the new columns.
+'''
+
+from django.db import connections, transaction
+
+from models import ADDED_COLUMNS
+
+
+def column_names(connection, table):
+    """ Names of the columns of `table`. """
+
+    cursor = connection.cursor()
+    return set(
+        row[0] for row in connection.introspection.get_table_description(cursor, table)
+    )
+
+
+def add_column_sql(connection, model, field_name):
+    """ ALTER TABLE statement adding a field's column. Existing rows get
+    NULL, or the field's default if it can't be null. """
+
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(field_name)
+    definition = field.db_type(connection=connection)
+    if field.null:
+        definition += ' NULL'
+    else:
+        default = field.get_db_prep_save(field.get_default(), connection=connection)
+        if not isinstance(default, (int, long, float)):
+            raise ValueError('No literal for the default of %s' % (field_name))
+        definition += ' NOT NULL DEFAULT %s' % (default)
+    return 'ALTER TABLE %s ADD COLUMN %s %s;' % (
+        qn(model._meta.db_table), qn(field.column), definition,
+    )
+
+
+def missing_columns(app_label='gradpay', using='default'):
+    """ ALTER TABLE statements for the added columns an app's tables
+    lack, as (column, sql) pairs. """
+
+    connection = connections[using]
+    existing = {}
+    missing = []
+    for model, field_name in ADDED_COLUMNS:
+        if model._meta.app_label != app_label:
+            continue
+        table = model._meta.db_table
+        if table not in existing:
+            existing[table] = column_names(connection, table)
+        column = model._meta.get_field(field_name).column
+        if column not in existing[table]:
+            missing.append((
+                '%s.%s' % (table, column),
+                add_column_sql(connection, model, field_name),
+            ))
+    return missing
+
+
+def add_columns(app_label='gradpay', using='default', progress=None):
+    """ Add the missing columns, returning their names. """
+
+    missing = missing_columns(app_label, using)
+    cursor = connections[using].cursor()
+    for name, sql in missing:
+        with transaction.commit_on_success(using=using):
+            cursor.execute(sql)
+        if progress:
+            progress(name, sql)
+    return [name for name, _ in missing]
@@ -0,0 +1,144 @@
+'''In-memory name search for autocomplete lookups.'''
+
+import re
+import json
+import gzip
+import time
+import hashlib
+import threading
+from cStringIO import StringIO
+
+
+STRIP_RE = re.compile(r'[\W_]+', re.U)
+
+
+def normalize(text):
+    """ Lower-case `text` and drop whitespace and punctuation. """
+
+    return STRIP_RE.sub('', text.lower())
+
+
+def trigrams(text):
+
+    return set(text[idx:idx + 3] for idx in range(len(text) - 2))
+
+
+class NameIndex(object):
+    """
+    Substring index over item names, ignoring case, whitespace and
+    punctuation. Candidates come from a trigram index and are verified
+    against the normalized name, then ranked: exact matches, then
+    matches at the start of the name, then at the start of a word,
+    then anywhere, with earlier and shorter matches first.
+    """
+
+    def __init__(self, items, key=unicode):
+
+        self.key = key
+        self.items = list(items)
+        self.names = [normalize(key(item)) for item in self.items]
+        self.words = [
+            [normalize(word) for word in key(item).split()]
+            for item in self.items
+        ]
+        self.grams = {}
+        for idx, name in enumerate(self.names):
+            for gram in trigrams(name):
+                self.grams.setdefault(gram, set()).add(idx)
+
+    def _candidates(self, term):
+
+        if len(term) < 3:
+            return range(len(self.items))
+        postings = sorted(
+            (self.grams.get(gram, set()) for gram in trigrams(term)),
+            key=len,
+        )
+        return set.intersection(*postings)
+
+    def _rank(self, idx, term):
+
+        name = self.names[idx]
+        if name == term:
+            tier = 0
+        elif name.startswith(term):
+            tier = 1
+        elif any(word.startswith(term) for word in self.words[idx]):
+            tier = 2
+        else:
+            tier = 3
+        return tier, name.find(term), len(name), name
+
+    def search(self, text):
+        """ Items whose names contain `text`, best matches first. """
+
+        term = normalize(text)
+        if not term:
+            return list(self.items)
+        matches = [
+            idx for idx in self._candidates(term)
+            if term in self.names[idx]
+        ]
+        matches.sort(key=lambda idx: self._rank(idx, term))
+        return [self.items[idx] for idx in matches]
+
+    def dictionary(self, ident, extra=None):
+        """
+        Compact JSON dictionary of the indexed items, as parallel
+        `names` and `ids` lists sorted by name, for matching on the
+        client. Returns (version, body, gzipped body); the version is
+        a digest of the body, so it changes whenever the rows do.
+        """
+
+        if getattr(self, '_dictionary', None) is None:
+            rows = sorted(
+                (self.key(item), ident(item)) for item in self.items
+            )
+            data = dict(extra or {})
+            data['names'] = [name for name, _ in rows]
+            data['ids'] = [pk for _, pk in rows]
+            body = json.dumps(data, separators=(',', ':'))
+            version = hashlib.sha1(body).hexdigest()[:16]
+            data['version'] = version
+            body = json.dumps(data, separators=(',', ':'))
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fh:
+                fh.write(body)
+            self._dictionary = version, body, buf.getvalue()
+        return self._dictionary
+
+
+class ModelIndex(object):
+    """
+    NameIndex over a model's rows, built on first search and rebuilt
+    after the model changes in this process or after `ttl` seconds, to
+    pick up changes made by other processes.
+    """
+
+    def __init__(self, queryset, ttl=300):
+
+        self.queryset = queryset
+        self.ttl = ttl
+        self.index = None
+        self.built = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self, *args, **kwargs):
+
+        self.index = None
+
+    def _stale(self):
+        return self.index is None or time.time() - self.built > self.ttl
+
+    def get(self):
+
+        if self._stale():
+            with self.lock:
+                if self._stale():
+                    self.index = NameIndex(self.queryset.all())
+                    self.built = time.time()
+        return self.index
+
+    def search(self, text):
+
+        return self.get().search(text)
@@ -1,6 +1,10 @@
 # Django settings for gradpay project.
 
-DEBUG = False
+import os
+
+# Set DJANGO_DEBUG=1 in development; runserver serves static files only
+# when DEBUG is on
+DEBUG = os.environ.get('DJANGO_DEBUG') == '1'
 TEMPLATE_DEBUG = DEBUG
 
 ADMINS = (
@@ -52,7 +56,7 @@ MEDIA_URL = ''
 # in apps' "static/" subdirectories and in STATICFILES_DIRS.
 # Example: "/home/media/media.lawrence.com/static/"
 #STATIC_ROOT = 'gradpay'
-STATIC_ROOT = os.path.join(PROJECT_ROOT, 'static')
+STATIC_ROOT = os.path.join(os.path.dirname(PROJECT_ROOT), 'staticfiles')
 
 # URL prefix for static files.
 # Example: "http://media.lawrence.com/static/"
@@ -65,6 +69,9 @@ STATICFILES_DIRS = (
     # Don't forget to use absolute paths, not relative paths.
 )
 
+# Hashed names and gzipped copies, served by the WSGI static layer
+STATICFILES_STORAGE = 'gradpay.storage.ManifestStaticFilesStorage'
+
 # List of finder classes that know how to find static files in
 # various locations.
 STATICFILES_FINDERS = (
@@ -84,6 +91,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'gradpay.metrics.MetricsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -123,6 +131,9 @@ INSTALLED_APPS = (
 
 # Time limit for django-registration
 ACCOUNT_ACTIVATION_DAYS = 7
+
+# Minimum time between activation reminders to the same address
+REMINDER_INTERVAL_DAYS = 2
 DEFAULT_FROM_EMAIL = 'gradpay.survey@gmail.com'
 
 # Email settings
@@ -135,8 +146,48 @@ import os
 MANDRILL_API_KEY = os.environ.get('MANDRILL_APIKEY')
 EMAIL_BACKEND = 'djrill.mail.backends.djrill.DjrillBackend'
 
+# Outbound mail queue (see the send_mail_queue command)
+MAIL_QUEUE_MAX_ATTEMPTS = 6
+MAIL_QUEUE_RETRY_SECONDS = 60
+MAIL_QUEUE_LEASE_SECONDS = 300
+
+# Geocoding settings (see the add_fips command)
+GEOCODER_BACKEND = 'gradpay.geo.geocode.GoogleGeocoder'
+GEOCODE_RATE = 2
+GEOCODE_CACHE = os.path.join(PROJECT_ROOT, 'geo', 'geocode_cache.json')
+# CSV of state, city, county rows for add_fips --offline; not shipped,
+# see README.md
+GAZETTEER_CITIES = os.path.join(PROJECT_ROOT, 'geo', 'cities.csv')
+
 # Misc settings
 
+# Seconds before in-process autocomplete indexes are rebuilt
+LOOKUP_INDEX_TTL = 300
+
+# Seconds before the survey data version expires (see models.survey_version)
+SURVEY_VERSION_TTL = 300
+
+# Stipend histograms (see the stipend_histogram view)
+HISTOGRAM_BINS = 12
+HISTOGRAM_MAX_BINS = 50
+HISTOGRAM_CACHE_SECONDS = 86400
+
+# Request metrics (see the metrics view): scrapers authenticate with
+# the token, or come from an allowed address when no token is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = ('127.0.0.1',)
+
+# Seconds to keep the home page counters for a survey version
+HOME_COUNTS_CACHE_SECONDS = 86400
+
+# Slow query log (see slowlog.py): queries over the threshold are
+# logged with their plan, and summarized by the slow_queries command
+SLOW_QUERY_SECONDS = 0.5
+SLOW_QUERY_EXPLAIN = True
+SLOW_QUERY_LOG = os.environ.get(
+    'SLOW_QUERY_LOG', os.path.join(os.path.dirname(PROJECT_ROOT), 'slow_queries.log')
+)
+
 # Minimum number of rows to be displayed in data tables
 MIN_TABLE_ROWS = 5
 MIN_CHORO_ROWS = 5
@@ -154,12 +205,26 @@ LOGGING = {
             '()': 'django.utils.log.RequireDebugFalse'
         }
     },
+    'formatters': {
+        'message': {
+            'format': '%(message)s',
+        },
+    },
     'handlers': {
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'slow_queries': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'message',
+        },
     },
     'loggers': {
         'django.request': {
@@ -167,6 +232,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'gradpay.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
@@ -0,0 +1,161 @@
+'''
+Slow query log: queries slower than SLOW_QUERY_SECONDS are written, with
+the shape of the request that ran them and the backend's query plan, as
+JSON lines to the `gradpay.slow_queries` logger (a rotating file; see
+LOGGING in settings). Queries are timed by the cursor wrapper in
+metrics.py.
+
+Parameter values can hold respondents' email addresses, so they are
+never written: parameters are logged by type only, and quoted values in
+plans and errors are masked.
+'''
+
+import os
+import re
+import json
+import logging
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils.encoding import force_unicode
+
+
+logger = logging.getLogger('gradpay.slow_queries')
+
+# Statements prefixing a query to get its plan, by backend
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+# Quoted literals, as backends show parameter values in plans and errors
+QUOTED_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+
+
+def mask(text):
+    """ `text` with quoted values replaced by '?'. """
+
+    return QUOTED_RE.sub("'?'", force_unicode(text))
+
+
+class _Shape(threading.local):
+    """ Shape of the current thread's request. """
+
+    value = None
+
+
+_shape = _Shape()
+
+
+def set_shape(**parts):
+    """ Describe the query the current request builds, such as its
+    grouping and sort variables, so slow queries from requests of the
+    same shape are summarized together. List parts whose order doesn't
+    matter should be sorted by the caller. """
+
+    _shape.value = ' '.join(
+        '%s=%s' % (name, ','.join(value) if isinstance(value, (list, tuple)) else value)
+        for name, value in sorted(parts.items())
+    )
+
+
+def clear_shape():
+
+    _shape.value = None
+
+
+def explain(connection, sql, params):
+    """ Lines of the backend's plan for query `sql`, or None where plans
+    aren't available. Only SELECTs are explained, and through a cursor
+    of their own so the explained query's results are kept. """
+
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    try:
+        cursor = connection._cursor()
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    except DatabaseError as error:
+        return ['EXPLAIN failed: %s' % (mask(error))]
+    if connection.vendor == 'sqlite':
+        # Rows are (id, parent, unused, detail)
+        return [mask(row[-1]) for row in rows]
+    return [mask(u' '.join(force_unicode(column) for column in row)) for row in rows]
+
+
+def log_query(connection, sql, params, seconds, view=None):
+    """ Log query `sql` if it took over SLOW_QUERY_SECONDS. """
+
+    if seconds < settings.SLOW_QUERY_SECONDS:
+        return
+    record = {
+        'time': datetime.datetime.utcnow().isoformat(),
+        'view': view,
+        'shape': _shape.value,
+        'seconds': round(seconds, 4),
+        'sql': force_unicode(sql),
+        'params': [type(param).__name__ for param in params or ()],
+        'plan': explain(connection, sql, params) if settings.SLOW_QUERY_EXPLAIN else None,
+    }
+    logger.info(json.dumps(record))
+
+
+def read_log(filename=None):
+    """ Records from the slow query log and its rotated copies, oldest
+    first, skipping lines that don't parse. """
+
+    filename = filename or settings.SLOW_QUERY_LOG
+    filenames = [filename]
+    idx = 1
+    while os.path.exists('%s.%d' % (filename, idx)):
+        filenames.insert(0, '%s.%d' % (filename, idx))
+        idx += 1
+
+    for name in filenames:
+        if not os.path.exists(name):
+            continue
+        with open(name) as fh:
+            for line in fh:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class ShapeSummary(object):
+
+    def __init__(self, view, shape):
+        self.view = view
+        self.shape = shape
+        self.count = 0
+        self.seconds = 0.0
+        self.worst = None
+
+    @property
+    def mean(self):
+        return self.seconds / self.count
+
+    def add(self, record):
+        self.count += 1
+        self.seconds += record['seconds']
+        if self.worst is None or record['seconds'] > self.worst['seconds']:
+            self.worst = record
+
+
+def summarize(records, view=None):
+    """ Slow queries grouped by view and shape, costliest first. """
+
+    summaries = {}
+    for record in records:
+        if view and record.get('view') != view:
+            continue
+        key = (record.get('view'), record.get('shape'))
+        if key not in summaries:
+            summaries[key] = ShapeSummary(*key)
+        summaries[key].add(record)
+    return sorted(summaries.values(), key=lambda summary: -summary.seconds)
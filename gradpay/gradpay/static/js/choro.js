@@ -13,12 +13,49 @@ var choro = (function() {
     
     // Initialize underlay data
     var state_info, county_info;
+
+    // Built map levels by source name
+    var geo_levels = {};
     
+    /* 
+     * Get the URL of the map source `name` at the coarsest level that
+     * still fits the map's width in CSS pixels, or the original GeoJSON
+     * if no levels have been built. Device pixels aren't counted: filled
+     * shapes a pixel or two off don't show, even on high-density screens.
+     */
+    function geo_url(name) {
+        var levels = geo_levels[name];
+        if (!levels || !levels.length) {
+            return '/static/geo/' + name + '.json';
+        }
+        var container = $(svg.node().parentNode).width() || width;
+        var pixels = Math.min(container, width);
+        for (var i = 0; i < levels.length; i++) {
+            if (levels[i].max_width === null || pixels <= levels[i].max_width) {
+                return '/static/' + levels[i].path;
+            }
+        }
+        return '/static/' + levels[levels.length - 1].path;
+    }
+
+    /* 
+     * Get map features from GeoJSON or TopoJSON
+     */
+    function features(data, name) {
+        if (data.type !== 'Topology') {
+            return data.features;
+        }
+        return topojson.feature(data, data.objects[name]).features
+            .filter(function(d) { return d.geometry; });
+    }
+
     /* 
      * 
      */
-    function init(selector) {
+    function init(selector, levels) {
         
+        geo_levels = levels || {};
+
         // Create SVG object
         svg = d3.select(selector)
             .append('svg:svg')
@@ -54,11 +91,11 @@ var choro = (function() {
         deferred.push($.getJSON('/choro_json?iv=' + iv + '_code&dv=' + dv));
         
         // Start request for state choropleth data
-        deferred.push(state_info || $.getJSON('/static/geo/us-states.json'));
+        deferred.push(state_info || $.getJSON(geo_url('us-states')));
 
         // Optionally start request for county choropleth data
         if (iv == 'county') {
-            deferred.push(county_info || $.getJSON('/static/geo/us-counties.json'))
+            deferred.push(county_info || $.getJSON(geo_url('us-counties')))
         }
         
         // Wait for AJAX requests to finish
@@ -71,7 +108,7 @@ var choro = (function() {
             // Draw counties
             if (iv == 'county') {
                 counties.selectAll('path')
-                    .data(county_info[0].features)
+                    .data(features(county_info[0], 'us-counties'))
                     .enter().append('path')
                     .attr('d', d3.geo.path());
                 states.selectAll('path')
@@ -80,7 +117,7 @@ var choro = (function() {
             
             // Draw states
             states.selectAll('path')
-                .data(state_info[0].features)
+                .data(features(state_info[0], 'us-states'))
                 .enter().append('path')
                 .attr('d', d3.geo.path());
             if (iv == 'state_code') {
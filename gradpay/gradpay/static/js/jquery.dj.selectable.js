@@ -14,6 +14,70 @@
 */
 (function ($) {
 
+    /* Lookup dictionaries, fetched once per page and shared by widgets */
+    var dictionaries = {};
+
+    function normalizeTerm(term) {
+        /* Lower-case and drop whitespace and punctuation, as the server does */
+        return term.toLowerCase().replace(/[\W_]+/g, '');
+    }
+
+    function escapeHtml(text) {
+        return $('<div>').text(text).html();
+    }
+
+    function loadDictionary(url) {
+        /* Fetch a lookup dictionary, normalizing its names once */
+        if (!dictionaries[url]) {
+            dictionaries[url] = $.ajax({url: url, dataType: 'json', cache: true})
+            .pipe(function (data) {
+                data.normalized = $.map(data.names, normalizeTerm);
+                data.words = $.map(data.names, function (name) {
+                    return [$.map(name.split(/\s+/), normalizeTerm)];
+                });
+                return data;
+            });
+        }
+        return dictionaries[url];
+    }
+
+    function searchDictionary(dictionary, term) {
+        /* Indexes of names containing the term, ranked like the server:
+        exact, prefix, word prefix, then anywhere */
+        var matches = [];
+        $.each(dictionary.normalized, function (idx, name) {
+            var pos = name.indexOf(term);
+            if (pos === -1) {
+                return;
+            }
+            var tier = 3;
+            if (name === term) {
+                tier = 0;
+            } else if (pos === 0) {
+                tier = 1;
+            } else {
+                $.each(dictionary.words[idx], function (i, word) {
+                    if (word.indexOf(term) === 0) {
+                        tier = 2;
+                        return false;
+                    }
+                });
+            }
+            matches.push([tier, pos, name.length, name, idx]);
+        });
+        matches.sort(function (a, b) {
+            for (var i = 0; i < 4; i++) {
+                if (a[i] !== b[i]) {
+                    return a[i] < b[i] ? -1 : 1;
+                }
+            }
+            return 0;
+        });
+        return $.map(matches, function (match) {
+            return match[4];
+        });
+    }
+
 	$.widget("ui.djselectable", {
 
         options: {
@@ -155,9 +219,42 @@
                 }
 				$.getJSON(url, query, unwrapResponse);
             }
+
+            function dictionarySource(request, response) {
+                /* Match against the lookup dictionary in the browser,
+                falling back to the server lookup if it can't be loaded
+                or the term has characters it can't normalize. */
+                var url = data.selectableDictionary || data['selectable-dictionary'];
+                if (!url || /[^\x00-\x7f]/.test(request.term)) {
+                    return dataSource(request, response);
+                }
+                var page = $(input).data("page") || 1;
+                loadDictionary(url).done(function (dictionary) {
+                    var term = normalizeTerm(request.term);
+                    var matches = term ?
+                        searchDictionary(dictionary, term) :
+                        $.map(dictionary.names, function (name, idx) { return idx; });
+                    var start = (page - 1) * dictionary.limit;
+                    var results = $.map(matches.slice(start, start + dictionary.limit), function (idx) {
+                        var name = dictionary.names[idx];
+                        return {id: dictionary.ids[idx], value: name, label: escapeHtml(name)};
+                    });
+                    if (matches.length > start + dictionary.limit) {
+                        results.push({
+                            id: '',
+                            value: '',
+                            label: dictionary.more,
+                            page: page + 1
+                        });
+                    }
+                    response(results);
+                }).fail(function () {
+                    dataSource(request, response);
+                });
+            }
             // Create base auto-complete lookup
             $(input).autocomplete({
-                source: dataSource,
+                source: dictionarySource,
                 change: function (event, ui) {
                     $(input).removeClass('xui-state-error');
                     $(input).parents('.control-group').removeClass('error');
@@ -0,0 +1,100 @@
+'''
+Static files storage for production: content-hashed names recorded in a
+manifest, and gzipped copies of text files for the static WSGI layer
+(see wsgi_static.py) to serve to clients that accept them.
+'''
+
+import os
+import gzip
+import json
+from fnmatch import fnmatch
+from urlparse import urldefrag
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    CachedStaticFilesStorage, StaticFilesStorage,
+)
+
+
+# Files worth compressing
+GZIP_PATTERNS = ('*.css', '*.js', '*.json', '*.svg', '*.html', '*.txt')
+
+
+class ManifestStaticFilesStorage(CachedStaticFilesStorage):
+    """
+    CachedStaticFilesStorage that writes the hashed names it generates to
+    a manifest, so workers look names up instead of hashing files (and
+    doing so again whenever the cache forgets them), and that writes a
+    gzipped copy of each text file next to it.
+    """
+
+    manifest_name = 'staticfiles.json'
+
+    def __init__(self, *args, **kwargs):
+        super(ManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        self.hashed_files = self.load_manifest()
+
+    def load_manifest(self):
+
+        try:
+            with self.open(self.manifest_name) as fh:
+                return json.loads(fh.read())
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def hashed_name(self, name, content=None):
+        try:
+            return super(ManifestStaticFilesStorage, self).hashed_name(name, content)
+        except ValueError:
+            # Leave references to missing files alone, such as the jQuery
+            # UI theme images, rather than failing collectstatic
+            return name
+
+    def url(self, name, force=False):
+        if settings.DEBUG and not force:
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        clean_name, fragment = urldefrag(name)
+        hashed_name = self.hashed_files.get(clean_name)
+        if hashed_name is None:
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        url = StaticFilesStorage.url(self, hashed_name)
+        if fragment:
+            url = '%s#%s' % (url, fragment)
+        return url
+
+    def post_process(self, paths, dry_run=False, **options):
+
+        if dry_run:
+            return
+
+        # Hash afresh rather than from the previous manifest
+        self.hashed_files = {}
+        hashed_files = {}
+        processed = super(ManifestStaticFilesStorage, self).post_process(
+            paths, dry_run, **options
+        )
+        for name, hashed_name, was_processed in processed:
+            hashed_files[name] = hashed_name
+            for path in (name, hashed_name):
+                self.gzip_file(path)
+            yield name, hashed_name, was_processed
+
+        self.hashed_files = hashed_files
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        with open(self.path(self.manifest_name), 'w') as fh:
+            json.dump(hashed_files, fh, indent=0, sort_keys=True)
+
+    def gzip_file(self, name):
+        """ Write `name`.gz if the file compresses. """
+
+        if not any(fnmatch(name, pattern) for pattern in GZIP_PATTERNS):
+            return
+        path = self.path(name)
+        with open(path, 'rb') as fh:
+            content = fh.read()
+        gzip_path = '%s.gz' % (path)
+        with gzip.GzipFile(gzip_path, 'wb', 9, mtime=0) as fh:
+            fh.write(content)
+        if os.path.getsize(gzip_path) >= len(content):
+            os.remove(gzip_path)
@@ -0,0 +1,223 @@
+'''
+Synthetic survey responses for load testing, drawn over the real
+institution, department, degree and support fixtures and written with
+bulk inserts. They are marked by their email domain, so they can be
+deleted again without touching real responses.
+'''
+
+import bisect
+import random
+import hashlib
+
+from django.core.management.color import no_style
+from django.db import connections, transaction, models
+
+import choices
+from models import Degree, Department, Institution, Support, Survey
+from models import SurveyAggregate, bump_survey_version
+
+
+# Share of responses by degree name, matched by substring
+DEGREE_WEIGHTS = (
+    ('PhD', 0.75),
+    ('Master', 0.2),
+    ('MD', 0.05),
+)
+
+# Reserved domain (RFC 2606) of synthetic surveys' addresses, which no
+# respondent can use
+SYNTHETIC_DOMAIN = 'example.edu'
+
+# Median stipend and spread (sigma of log stipend)
+STIPEND_MEDIAN = 24000
+STIPEND_SIGMA = 0.25
+
+
+def codes(choice_list):
+
+    return [code for code, _ in choice_list]
+
+
+def zipf_weights(count, exponent=1.0):
+    """ Weights making a few items popular and most rare, as responses
+    are spread over institutions and departments. """
+
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class WeightedChoice(object):
+
+    def __init__(self, items, weights, rng):
+
+        self.items = items
+        self.rng = rng
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def __call__(self):
+
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_right(self.cumulative, point)]
+
+
+class SurveyGenerator(object):
+    """
+    Draw plausible surveys: popular institutions and departments get
+    most responses, and stipends are log-normal with institution and
+    department effects, so aggregates have realistic spread.
+    """
+
+    def __init__(self, seed=None, active_fraction=0.9):
+
+        self.rng = random.Random(seed)
+        self.active_fraction = active_fraction
+
+        institutions = list(Institution.objects.values_list('pk', flat=True))
+        departments = list(Department.objects.values_list('pk', flat=True))
+        self.rng.shuffle(institutions)
+        self.rng.shuffle(departments)
+        self.institution = WeightedChoice(
+            institutions, zipf_weights(len(institutions), 0.8), self.rng
+        )
+        self.department = WeightedChoice(
+            departments, zipf_weights(len(departments), 0.8), self.rng
+        )
+
+        # Stipend multipliers per institution and department
+        self.effects = {}
+        for key in [('i', pk) for pk in institutions] + [('d', pk) for pk in departments]:
+            self.effects[key] = self.rng.lognormvariate(0, 0.15)
+
+        degrees = dict(Degree.objects.values_list('name', 'pk'))
+        pairs = [
+            (pk, weight)
+            for pattern, weight in DEGREE_WEIGHTS
+            for name, pk in degrees.items() if pattern in name
+        ]
+        self.degree = WeightedChoice(
+            [pk for pk, _ in pairs], [weight for _, weight in pairs], self.rng
+        )
+        self.supports = list(Support.objects.values_list('pk', flat=True))
+
+    def survey(self, pk):
+        """ An unsaved survey with primary key `pk`, its degree and its
+        support types. """
+
+        rng = self.rng
+        institution = self.institution()
+        department = self.department()
+        degree = self.degree()
+        supports = rng.sample(self.supports, rng.randint(1, min(2, len(self.supports))))
+
+        stipend = STIPEND_MEDIAN * rng.lognormvariate(0, STIPEND_SIGMA)
+        stipend *= self.effects['i', institution] * self.effects['d', department]
+        total_terms = rng.choice([6, 8, 10, 12])
+        start_year = rng.randint(2005, 2014)
+        active = rng.random() < self.active_fraction
+
+        survey = Survey(
+            pk=pk,
+            email='synthetic%d@%s' % (pk, SYNTHETIC_DOMAIN),
+            is_active=active,
+            activation_key='ACTIVATED' if active else hashlib.sha1(str(pk)).hexdigest(),
+            institution_id=institution,
+            department_id=department,
+            start_year=start_year,
+            graduation_year=start_year + rng.randint(2, 7),
+            gender=rng.choice(codes(choices.GENDER_CHOICES)),
+            age=rng.randint(21, 40),
+            international_student=rng.choice(codes(choices.INTERNATIONAL_CHOICES)),
+            stipend=int(round(stipend, -2)),
+            summer_stipend=rng.choice(codes(choices.SUMMER_STIPEND_CHOICES)),
+            tuition_coverage=rng.choice(codes(choices.TUITION_CHOICES)),
+            fees=rng.choice(codes(choices.FEES_CHOICES)),
+            total_terms=total_terms,
+            teaching_terms=rng.randint(0, total_terms),
+            contract=rng.choice(codes(choices.CONTRACT_CHOICES)),
+            part_time_work=rng.choice(codes(choices.PART_TIME_CHOICES)),
+            student_loans=rng.choice(codes(choices.LOAN_CHOICES)),
+            union_member=rng.choice(codes(choices.UNION_CHOICES)),
+            health_benefits=rng.choice(codes(choices.BENEFIT_CHOICES)),
+            dental_benefits=rng.choice(codes(choices.BENEFIT_CHOICES)),
+            vision_benefits=rng.choice(codes(choices.BENEFIT_CHOICES)),
+            leave=rng.choice(codes(choices.LEAVE_CHOICES)),
+            career=rng.choice(codes(choices.CAREER_CHOICES)),
+        )
+        survey.set_hidden(supports, [degree])
+        return survey, degree, supports
+
+
+def _reset_sequence(model, using):
+
+    connection = connections[using]
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+        cursor.execute(sql)
+
+
+def generate_surveys(count, batch_size=5000, seed=None, active_fraction=0.9,
+                     refresh=True, progress=None, using='default'):
+    """ Insert `count` synthetic surveys, with their degrees and support
+    types, `batch_size` rows per INSERT. Primary keys are assigned here
+    so the many-to-many rows can be inserted in bulk too. """
+
+    generator = SurveyGenerator(seed, active_fraction)
+    DegreeLink = Survey.degree.through
+    SupportLink = Survey.support_types.through
+
+    start = (Survey.objects.aggregate(last=models.Max('pk'))['last'] or 0) + 1
+    for offset in range(0, count, batch_size):
+        surveys, degrees, supports = [], [], []
+        for pk in range(start + offset, start + min(offset + batch_size, count)):
+            survey, degree, support_ids = generator.survey(pk)
+            surveys.append(survey)
+            degrees.append(DegreeLink(survey_id=pk, degree_id=degree))
+            supports.extend(
+                SupportLink(survey_id=pk, support_id=support)
+                for support in support_ids
+            )
+        with transaction.commit_on_success(using=using):
+            Survey.objects.using(using).bulk_create(surveys)
+            DegreeLink.objects.using(using).bulk_create(degrees)
+            SupportLink.objects.using(using).bulk_create(supports)
+        if progress:
+            progress(offset + len(surveys), count)
+
+    _reset_sequence(Survey, using)
+    bump_survey_version()
+    if refresh:
+        SurveyAggregate.objects.refresh()
+
+
+def synthetic_surveys(using='default'):
+    """ Surveys inserted by generate_surveys. """
+
+    return Survey.objects.using(using).filter(email__endswith='@' + SYNTHETIC_DOMAIN)
+
+
+def delete_synthetic_surveys(batch_size=5000, refresh=True, progress=None,
+                             using='default'):
+    """ Delete synthetic surveys in batches of at most `batch_size`,
+    calling `progress(deleted, total)` after each batch. Returns the
+    number of surveys deleted. """
+
+    surveys = synthetic_surveys(using)
+    total = surveys.count()
+    deleted = 0
+    while True:
+        pks = list(surveys.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.commit_on_success(using=using):
+            Survey.objects.using(using).filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if progress:
+            progress(deleted, total)
+
+    bump_survey_version()
+    if refresh:
+        SurveyAggregate.objects.refresh()
+    return deleted
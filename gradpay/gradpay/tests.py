@@ -0,0 +1,583 @@
+import os
+import json
+import logging
+import shutil
+import tempfile
+import datetime
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from pygeocoder import GeocoderError
+
+import activation
+import aggregates
+import benchmark
+import indexes
+import metrics
+import plans
+import schema
+import settings
+import slowlog
+import wsgi_static
+from models import DEGREE_MASK_BITS, Degree, Department, Institution, Support, Survey
+from models import QueuedEmail, SurveyAggregate, AGGREGATE_GROUPS
+from synthetic import generate_surveys, delete_synthetic_surveys
+from views import encode_cursor
+from geo import gazetteer, geocode, topology
+
+
+INSTITUTIONS = (
+    ('University of Iowa', 'Iowa City', 'IA', '19', 'Johnson', '19103'),
+    ('Iowa State University', 'Ames', 'IA', '19', 'Story', '19169'),
+    ('Rice University', 'Houston', 'TX', '48', 'Harris', '48201'),
+    ('University of Texas at Austin', 'Austin', 'TX', '48', 'Travis', '48453'),
+    ('Yale University', 'New Haven', 'CT', '09', 'New Haven', '09009'),
+    ('Brown University', 'Providence', 'RI', '44', 'Providence', '44007'),
+)
+
+DEPARTMENTS = ('Biology', 'Chemistry', 'History', 'Economics', 'Physics')
+
+DEGREES = ('PhD', 'Master of Science', 'MD')
+
+SUPPORTS = (
+    'Competitive grant/fellowship to student',
+    'Teaching assistantship',
+    'Research assistantship',
+)
+
+
+def create_reference_data():
+
+    for name, city, state, state_code, county, county_code in INSTITUTIONS:
+        Institution.objects.create(
+            name=name, city=city, state=state, category='Research',
+            county=county, county_code=county_code, state_code=state_code,
+        )
+    for name in DEPARTMENTS:
+        Department.objects.create(name=name)
+    for name in DEGREES:
+        Degree.objects.create(name=name)
+    for name in SUPPORTS:
+        Support.objects.create(name=name, tooltip='')
+
+
+class SurveyData(object):
+    """ Reference data, the composite indexes and `surveys` synthetic
+    responses, with aggregates built from them. """
+
+    surveys = 300
+    active_fraction = 0.6
+
+    def setUp(self):
+
+        # The test database is built by syncdb, which skips these
+        indexes.create_indexes()
+        create_reference_data()
+        generate_surveys(
+            self.surveys, seed=1, active_fraction=self.active_fraction,
+        )
+
+
+class GradPayTestCase(SurveyData, TestCase):
+    pass
+
+
+class SurveyAggregateTest(GradPayTestCase):
+
+    def snapshot(self):
+
+        columns = [column for column, _ in AGGREGATE_GROUPS]
+        return dict(
+            (
+                (record.grouping, record.degree_id) +
+                tuple(getattr(record, column) for column in columns),
+                record,
+            )
+            for record in SurveyAggregate.objects.all()
+        )
+
+    def test_recompute_hidden_fields_refreshes(self):
+
+        expected = dict(
+            (key, record.num_resp) for key, record in self.snapshot().items()
+        )
+        SurveyAggregate.objects.all().delete()
+        Survey.objects.update(degree_mask=0)
+        Survey.objects.recompute_hidden_fields()
+        self.assertEqual(
+            dict((key, record.num_resp) for key, record in self.snapshot().items()),
+            expected,
+        )
+
+    def test_incremental_matches_refresh(self):
+
+        # Give some pending surveys the address of an active one, so
+        # activating them deletes it, and others the address of another
+        # pending survey
+        pending = list(Survey.objects.filter(is_active=False).order_by('pk'))
+        active = list(Survey.objects.filter(is_active=True).order_by('pk'))
+        for survey, other in zip(pending[:20], active):
+            Survey.objects.filter(pk=survey.pk).update(email=other.email)
+        for survey, other in zip(pending[20:30], pending[30:40]):
+            Survey.objects.filter(pk=survey.pk).update(email=other.email)
+
+        for survey in pending[:30]:
+            self.assertIsNotNone(Survey.objects.activate(survey.activation_key))
+        self.assertEqual(Survey.objects.filter(pk__in=[s.pk for s in active[:20]]).count(), 0)
+
+        incremental = self.snapshot()
+        SurveyAggregate.objects.refresh()
+        cold = self.snapshot()
+
+        self.assertEqual(sorted(incremental), sorted(cold))
+        for key, expected in cold.items():
+            record = incremental[key]
+            self.assertEqual(record.num_resp, expected.num_resp)
+            self.assertAlmostEqual(record.sum_teach_frac, expected.sum_teach_frac)
+            self.assertEqual(record.sum_student_loans, expected.sum_student_loans)
+            self.assertEqual(record.sum_part_time_work, expected.sum_part_time_work)
+            self.assertEqual(record.sum_fellowship, expected.sum_fellowship)
+            self.assertLessEqual(
+                abs(record.avg_stipend - expected.avg_stipend),
+                0.01 * expected.avg_stipend,
+            )
+
+        # The running sketches stay within their error bound of the
+        # exact percentiles
+        fields = dict(AGGREGATE_GROUPS)
+        for key, record in incremental.items():
+            surveys = Survey.objects.with_degree(record.degree_id).filter(
+                is_active=True,
+                **dict(
+                    (fields[column], getattr(record, column))
+                    for column in record.grouping.split(',') if column
+                )
+            )
+            stipends = sorted(surveys.values_list('stipend', flat=True))
+            self.assertEqual(len(stipends), record.num_resp)
+            for fraction, estimate in [
+                (0.1, record.stipend_p10), (0.25, record.stipend_p25),
+                (0.5, record.avg_stipend),
+                (0.75, record.stipend_p75), (0.9, record.stipend_p90),
+            ]:
+                exact = aggregates.interpolate(stipends, fraction)
+                self.assertLessEqual(
+                    abs(estimate - exact),
+                    aggregates.SKETCH_ACCURACY * exact + 1e-6,
+                    '%s at %s: %s vs %s' % (key, fraction, estimate, exact),
+                )
+
+    def test_unique_group(self):
+
+        record = SurveyAggregate.objects.all()[0]
+        record.pk = None
+        self.assertRaises(IntegrityError, record.save)
+
+
+class SyntheticTest(GradPayTestCase):
+
+    surveys = 50
+
+    def test_benchmark_activates_synthetic_surveys(self):
+
+        real = Survey.objects.filter(is_active=False)[0]
+        Survey.objects.filter(pk=real.pk).update(email='student@uiowa.edu')
+        inactive = Survey.objects.filter(is_active=False).count()
+        with self.assertRaises(RuntimeError):
+            benchmark.measure_activation(Client(), repeat=inactive - 1)
+        benchmark.measure_activation(Client(), repeat=inactive - 2)
+        self.assertEqual(list(Survey.objects.filter(is_active=False)), [real])
+
+    def test_delete_synthetic_surveys(self):
+
+        real = Survey.objects.filter(is_active=True)[0]
+        Survey.objects.filter(pk=real.pk).update(email='student@uiowa.edu')
+        self.assertEqual(delete_synthetic_surveys(batch_size=20), self.surveys - 1)
+        self.assertEqual(list(Survey.objects.values_list('pk', flat=True)), [real.pk])
+        self.assertEqual(
+            set(SurveyAggregate.objects.values_list('num_resp', flat=True)), set([1])
+        )
+
+
+class ExpiryTest(GradPayTestCase):
+
+    surveys = 50
+
+    def test_delete_expired_surveys(self):
+
+        old = now() - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+        Survey.objects.all().update(time_created=old)
+        pending = list(Survey.objects.filter(is_active=False).values_list('pk', flat=True))
+        active = Survey.objects.filter(is_active=True).count()
+
+        # A survey activated after the batch was selected is kept
+        Survey.objects.filter(pk=pending[0]).update(is_active=True)
+        self.assertEqual(Survey.objects._delete_batch(pending), len(pending) - 1)
+        self.assertEqual(Survey.objects.count(), active + 1)
+        self.assertEqual(Survey.objects.delete_expired_surveys(), 0)
+
+
+class ReminderTest(GradPayTestCase):
+
+    def test_send_reminders(self):
+
+        pending = Survey.objects.filter(is_active=False)
+        count = pending.count()
+        self.assertEqual(Survey.objects.send_reminders(chunk_size=7, workers=2), count)
+        self.assertEqual(len(mail.outbox), count)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(pending.values_list('email', flat=True)),
+        )
+        self.assertEqual(pending.filter(last_reminded__isnull=True).count(), 0)
+
+        # Addresses reminded recently are skipped
+        self.assertEqual(Survey.objects.send_reminders(), 0)
+        self.assertEqual(len(mail.outbox), count)
+
+
+class FailingBackend(BaseEmailBackend):
+
+    def send_messages(self, messages):
+        raise IOError('Mail server unavailable')
+
+
+class UnreachableBackend(BaseEmailBackend):
+
+    def open(self):
+        raise IOError('Connection refused')
+
+    def send_messages(self, messages):
+        raise AssertionError('Sent without a connection')
+
+
+class QueuedEmailTest(GradPayTestCase):
+
+    surveys = 10
+
+    def test_queue_activation_email(self):
+
+        survey = Survey.objects.filter(is_active=False)[0]
+        activation.queue_activation_email(survey)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(QueuedEmail.objects.send_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [survey.email])
+        self.assertIn(survey.activation_key, mail.outbox[0].body)
+
+        # Sent messages leave the queue
+        self.assertEqual(QueuedEmail.objects.send_batch(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='gradpay.tests.FailingBackend')
+    def test_failed_email_is_retried_later(self):
+
+        survey = Survey.objects.filter(is_active=False)[0]
+        activation.queue_activation_email(survey)
+
+        self.assertEqual(QueuedEmail.objects.send_batch(), (0, 1))
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('Mail server unavailable', queued.last_error)
+
+        # Not due again until its backoff has passed
+        self.assertEqual(QueuedEmail.objects.send_batch(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='gradpay.tests.UnreachableBackend')
+    def test_connection_failure_is_recorded(self):
+
+        for survey in Survey.objects.filter(is_active=False)[:2]:
+            activation.queue_activation_email(survey)
+
+        self.assertEqual(QueuedEmail.objects.send_batch(), (0, 2))
+        for queued in QueuedEmail.objects.all():
+            self.assertEqual(queued.attempts, 1)
+            self.assertIn('Connection refused', queued.last_error)
+
+
+class GeocodeTest(TestCase):
+
+    def test_transient_errors_are_not_cached(self):
+
+        found = ('University of Iowa', 'Iowa City', 'IA')
+        missing = ('Nowhere College', 'Nowhere', 'IA')
+        limited = ('Iowa State University', 'Ames', 'IA')
+        geocoder = geocode.StubGeocoder({
+            found: 'Johnson County',
+            missing: '',
+            limited: GeocoderError(GeocoderError.G_GEO_OVER_QUERY_LIMIT),
+        })
+        cache = geocode.GeocodeCache()
+
+        results = dict(geocode.geocode_institutions(
+            [found, missing, limited], geocoder, cache,
+            geocode.RateLimiter(1000, burst=10), retry_seconds=0,
+        ))
+        self.assertEqual(results[found], ('Johnson County', '19103'))
+        self.assertEqual(results[missing], ('', ''))
+        self.assertEqual(results[limited], ('', ''))
+
+        # Answers are cached; the rate limited lookup was retried, and
+        # is left for the next run
+        self.assertEqual(cache.get(*found), 'Johnson County')
+        self.assertEqual(cache.get(*missing), '')
+        self.assertEqual(cache.get(*limited), None)
+        self.assertEqual(geocoder.calls.count(limited), geocode.GEOCODE_ATTEMPTS)
+
+
+class CountyResolverTest(TestCase):
+
+    def test_resolve(self):
+
+        resolver = gazetteer.CountyResolver(
+            geocode.f, [('TX', 'Houston', 'Harris County')]
+        )
+        self.assertEqual(resolver.resolve('Houston', 'TX'), ('Harris', '48201'))
+        self.assertEqual(resolver.resolve('St. Louis', 'MO'), ('St. Louis city', '29510'))
+        self.assertEqual(resolver.resolve('Washington', 'DC'), ('District of Columbia', '11001'))
+
+        # Cities aren't placed in a county of the same name
+        self.assertEqual(resolver.resolve('Jackson', 'MS'), ('', ''))
+        self.assertEqual(resolver.resolve('Lincoln', 'NE'), ('', ''))
+
+
+class TopologyTest(TestCase):
+
+    def test_small_shapes_are_kept(self):
+
+        def square(x, y, size):
+            return {'type': 'Polygon', 'coordinates': [[
+                [x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y],
+            ]]}
+
+        features = [
+            {'id': 'large', 'geometry': square(0, 0, 100)},
+            {'id': 'small', 'geometry': square(50.2, 50.2, 0.1)},
+        ]
+        data = topology.Topology(features, quantization=11).to_topojson('shapes')
+        geometries = data['objects']['shapes']['geometries']
+        self.assertEqual([g['type'] for g in geometries], ['Polygon', 'Polygon'])
+        self.assertEqual(len(geometries[1]['arcs'][0]), 1)
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+@override_settings(SLOW_QUERY_SECONDS=0)
+class SlowLogTest(TestCase):
+
+    def setUp(self):
+
+        self.handler = RecordingHandler()
+        slowlog.logger.addHandler(self.handler)
+        self.cursor = metrics.TimedCursor(connection.cursor(), connection)
+
+    def tearDown(self):
+
+        slowlog.logger.removeHandler(self.handler)
+
+    def test_params_not_logged(self):
+
+        self.cursor.execute(
+            'SELECT id FROM gradpay_survey WHERE email = %s AND stipend > %s',
+            ['student@uiowa.edu', 1000],
+        )
+        self.assertTrue(self.handler.records)
+        for record in self.handler.records:
+            self.assertEqual(record['params'], ['str', 'int'])
+            self.assertNotIn('uiowa', json.dumps(record))
+        self.assertEqual(slowlog.mask(u'Filter: (email = \'a@b.edu\'::text)'), u"Filter: (email = '?'::text)")
+
+    def test_failed_queries_not_logged(self):
+
+        with self.assertRaises(DatabaseError):
+            self.cursor.execute('SELECT missing FROM gradpay_survey', [])
+        self.assertEqual(self.handler.records, [])
+
+
+class StaticFilesTest(TestCase):
+
+    def setUp(self):
+
+        self.root = tempfile.mkdtemp()
+        for name in ['app.js', 'app.js.gz']:
+            with open(os.path.join(self.root, name), 'wb') as fh:
+                fh.write('var a;')
+        self.app = wsgi_static.StaticFiles(None, self.root)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.root)
+
+    def request(self, path, **environ):
+
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        environ.update(PATH_INFO=path, REQUEST_METHOD='GET')
+        self.app(environ, start_response)
+        return response['status'], response['headers']
+
+    def test_not_modified(self):
+
+        status, headers = self.request('/static/app.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        status, headers = self.request(
+            '/static/app.js', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=headers['ETag'],
+        )
+        self.assertEqual(status, '304 Not Modified')
+        for name in ['Content-Type', 'Content-Length', 'Content-Encoding']:
+            self.assertNotIn(name, headers)
+
+    def test_gzipped_copy_not_served_directly(self):
+
+        status, _ = self.request('/static/app.js.gz')
+        self.assertEqual(status, '404 Not Found')
+
+
+class ViewTest(GradPayTestCase):
+
+    surveys = 100
+
+    def get(self, view, **params):
+
+        paths = dict((name, (path, params)) for name, path, params in benchmark.BENCHMARK_VIEWS)
+        path, defaults = paths[view]
+        return self.client.get(path, dict(defaults, **params))
+
+    def test_views(self):
+
+        for name, _, _ in benchmark.BENCHMARK_VIEWS:
+            response = self.get(name)
+            self.assertEqual(response.status_code, 200, name)
+
+    def test_bad_degree(self):
+
+        degree = Degree.objects.get(name='MD').pk
+        for name, _, _ in benchmark.BENCHMARK_VIEWS[1:]:
+            self.assertEqual(self.get(name, degree=str(degree)).status_code, 200, name)
+            for value in ['abc', '-1', str(DEGREE_MASK_BITS), '99', str(degree + 100)]:
+                response = self.get(name, degree=value)
+                self.assertEqual(response.status_code, 400, '%s %s' % (name, value))
+
+    def test_api_cursor(self):
+
+        response = self.get('api_institution', limit='1')
+        next_cursor = json.loads(response.content)['next']
+        self.assertIsNotNone(next_cursor)
+        response = self.get('api_institution', limit='1', after=next_cursor)
+        self.assertEqual(response.status_code, 200)
+
+        for cursor in ['zzz', 'WzFd', encode_cursor([1, 2, 3]), encode_cursor({'a': 1})]:
+            response = self.get('api_institution', after=cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_results_cursor(self):
+
+        response = self.get('results_json', iDisplayLength='1')
+        next_cursor = json.loads(response.content)['sNext']
+        response = self.get('results_json', iDisplayLength='1', after=next_cursor)
+        self.assertEqual(response.status_code, 200)
+
+        for cursor in ['zzz', 'WzFd', encode_cursor(['abc', 1]), encode_cursor([1.5, 'abc'])]:
+            response = self.get('results_json', after=cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_results_cursor_nulls(self):
+
+        # Rows without a stipend sort together wherever the backend puts NULLs
+        groups = SurveyAggregate.objects.filter(grouping='institution')
+        groups.filter(pk__in=list(groups.values_list('pk', flat=True)[:5])).update(avg_stipend=None)
+        for direction in ['asc', 'desc']:
+            response = self.get('results_json', sSortDir_0=direction)
+            expected = [row[0] for row in json.loads(response.content)['aaData']]
+            walked = []
+            after = None
+            while True:
+                params = dict(sSortDir_0=direction, iDisplayLength='3')
+                if after:
+                    params['after'] = after
+                response = self.get('results_json', **params)
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.content)
+                if not data['aaData']:
+                    break
+                walked += [row[0] for row in data['aaData']]
+                after = data['sNext']
+            self.assertEqual(walked, expected, direction)
+
+    def test_api_stipend_bands(self):
+
+        fields = 'stipend_p10,stipend_p25,stipend,stipend_p75,stipend_p90'
+        response = self.get('api_institution', fields=fields)
+        data = json.loads(response.content)['data']
+        self.assertTrue(data['institution'])
+        for row in zip(*[data[field] for field in fields.split(',')]):
+            self.assertEqual(list(row), sorted(row))
+
+        response = self.get('api_institution', stipend_p90__gte='abc')
+        self.assertEqual(response.status_code, 400)
+
+
+def plan_regressions():
+
+    plans.analyze()
+    return [
+        (view, sql, plan, scans)
+        for view, sql, params, plan, scans in plans.check_plans()
+        if scans
+    ]
+
+
+class QueryPlanTest(SurveyData, TransactionTestCase):
+
+    # ANALYZE and DROP INDEX commit on SQLite, so the data is flushed
+    # after each test rather than rolled back
+    surveys = 3000
+
+    def test_views_use_indexes(self):
+
+        regressions = plan_regressions()
+        self.assertEqual(regressions, [], '\n\n'.join(
+            '%s reads %s sequentially:\n%s\n%s' % (
+                view, ', '.join(scans), sql, '\n'.join(plan)
+            )
+            for view, sql, plan, scans in regressions
+        ))
+
+    def test_dropped_index_is_reported(self):
+
+        connection.cursor().execute(
+            'DROP INDEX %s' % connection.ops.quote_name('gradpay_survey_active_stipend')
+        )
+        views = set(view for view, _, _, _ in plan_regressions())
+        self.assertIn('stipend_histogram', views)
+
+
+class SchemaTest(TestCase):
+
+    def test_added_columns(self):
+
+        self.assertEqual(schema.missing_columns(), [])
+        self.assertTrue(
+            schema.add_column_sql(connection, Survey, 'last_reminded').endswith(' NULL;')
+        )
+        self.assertTrue(
+            schema.add_column_sql(connection, Survey, 'degree_mask').endswith(
+                ' NOT NULL DEFAULT 0;'
+            )
+        )
@@ -4,7 +4,11 @@ from django.template import RequestContext
 
 # Import models
 from models import Survey
+from models import survey_version
+from models import home_counts
+from models import SurveyAggregate
 from models import Degree
+from models import DEGREE_MASK_BITS
 
 # Import forms
 from forms import ResultForm
@@ -12,13 +16,25 @@ from forms import ScatterForm
 from forms import SurveyForm
 
 import json
-from django.http import HttpResponse
-from django.db.models import Avg, Count
-from gradpay.aggregates import Median
+import base64
+import hashlib
+from functools import wraps
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.http import HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from gradpay import histogram
+from gradpay import export
+from gradpay import metrics as request_metrics
+from gradpay import slowlog
+from gradpay.geo import topology
+from django.db import connection
 from django.db.models import Q
 
 from django.conf import settings
 
+from selectable.registry import registry
+
 # Set up hash regex
 import re
 SHA1_RE = re.compile('^[a-f0-9]{40}$')
@@ -47,11 +63,12 @@ def fmt_factory(pct, rnd):
 
 class VarInfo(object):
 
-    def __init__(self, name, type, fun=None, agg=None):
+    def __init__(self, name, type, fun=None, column=None):
         self.name = name
         self.type = type
         self.fun = fun
-        self.agg = agg
+        # Column in SurveyAggregate
+        self.column = column or name
 
     def extract(self, row):
         val = row[self.name]
@@ -60,54 +77,68 @@ class VarInfo(object):
         return val
 
 vars = {
-    'institution': VarInfo('institution__name', 'stored'),
-    'state': VarInfo('institution__state', 'stored'),
-    'state_code': VarInfo('institution__state_code', 'stored'),
-    'county_code': VarInfo('institution__county_code', 'stored'),
-    'department': VarInfo('department__name', 'stored'),
+    'institution': VarInfo('institution__name', 'stored', column='institution'),
+    'state': VarInfo('institution__state', 'stored', column='state'),
+    'state_code': VarInfo('institution__state_code', 'stored', column='state_code'),
+    'county_code': VarInfo('institution__county_code', 'stored', column='county_code'),
+    'department': VarInfo('department__name', 'stored', column='department'),
+    # Computed variables are read from SurveyAggregate; the stipend
+    # median and percentile bands are estimated from its stipend sketches
     'stipend': VarInfo(
         'avg_stipend',
         'computed',
-        fmt_factory(False, 0),
-        agg=Median('stipend')
+        fmt_factory(False, 0)
+    ),
+    'stipend_p10': VarInfo(
+        'stipend_p10',
+        'computed',
+        fmt_factory(False, 0)
+    ),
+    'stipend_p25': VarInfo(
+        'stipend_p25',
+        'computed',
+        fmt_factory(False, 0)
+    ),
+    'stipend_p75': VarInfo(
+        'stipend_p75',
+        'computed',
+        fmt_factory(False, 0)
+    ),
+    'stipend_p90': VarInfo(
+        'stipend_p90',
+        'computed',
+        fmt_factory(False, 0)
     ),
     'teaching': VarInfo(
         'avg_teach_frac',
         'computed',
-        fmt_factory(True, 0),
-        agg=Avg('_teaching_fraction')
+        fmt_factory(True, 0)
     ),
     'teaching_num': VarInfo(
         'avg_teach_frac',
         'computed',
-        fmt_factory(False, 2),
-        agg=Avg('_teaching_fraction')
+        fmt_factory(False, 2)
     ),
     'num_resp': VarInfo(
         'num_resp',
-        'computed',
-        agg=Count('stipend')
+        'computed'
     ),
     'loans_fmt': VarInfo(
         '_has_student_loans',
         'computed',
-        fmt_factory(True, 0),
-        agg=Avg('_has_student_loans')
+        fmt_factory(True, 0)
     ),
     'loans': VarInfo(
         '_has_student_loans',
-        'computed',
-        agg=Avg('_has_student_loans')
+        'computed'
     ),
     'part_time_work': VarInfo(
         '_has_part_time_work',
-        'computed',
-        agg=Avg('_has_part_time_work')
+        'computed'
     ),
     'fellowship': VarInfo(
         '_has_fellowship',
-        'computed',
-        agg=Avg('_has_fellowship')
+        'computed'
     ),
 }
 
@@ -116,76 +147,288 @@ sort_map = {
     'desc': '-',
 }
 
-def phds_only(rows):
+class BadRequest(Exception):
+    pass
+
+def bad_request(view):
+    """Answer BadRequest errors raised by a view with a 400 response.
+
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return HttpResponseBadRequest(str(error), mimetype='text/plain')
+    return wrapped
+
+def get_degree(request, default=None):
+    """Get the degree id requested in the `degree` parameter, raising
+    BadRequest unless it names a degree.
+
+    """
+    degree = request.GET.get('degree')
+    if not degree:
+        return default
+    try:
+        degree = int(degree)
+    except ValueError:
+        raise BadRequest('Invalid degree %s' % (degree))
+    # Keys past the degree mask can't name a degree
+    if not 0 <= degree < DEGREE_MASK_BITS:
+        raise BadRequest('Unknown degree %d' % (degree))
+    try:
+        Degree.objects.get_cached(pk=degree)
+    except Degree.DoesNotExist:
+        raise BadRequest('Unknown degree %d' % (degree))
+    return degree
+
+def aggregate_fields(columns):
+    """Get SurveyAggregate fields holding variables.
+
+    """
+    return list(set(vars[col].column for col in columns))
+
+def rename_row(row, columns):
+    """Key an aggregate row by variable name like the corresponding
+    Survey queries.
+
+    """
+    return {vars[col].name: row[vars[col].column] for col in columns}
+
+def aggregate_rows(rows, columns):
+    """Fetch precomputed aggregate rows, keyed by variable name.
 
-    degrees = Degree.objects
-    phd_degree = degrees.filter(name__contains='PhD').get()
-    return rows.filter(degree__in=[phd_degree])
+    """
+    for row in rows.values(*aggregate_fields(columns)):
+        yield rename_row(row, columns)
+
+def encode_cursor(values):
+
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+def decode_cursor(cursor, length):
+    """Decode a cursor holding `length` sort values, raising
+    BadRequest if it wasn't made by encode_cursor for this ordering.
+
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise BadRequest('Invalid cursor')
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (basestring, int, long, float)):
+            raise BadRequest('Invalid cursor')
+    return values
+
+# Backends that sort NULL above every value; the rest sort it below
+NULLS_HIGH_VENDORS = ('postgresql', 'oracle')
+
+def keyset_filter(order_by_fields, values):
+    """Build a filter for rows sorting after `values` under
+    `order_by_fields`, e.g. (a > x) | (a = x & b < y) for ['a', '-b'].
+    None values match NULLs, which sort where the database puts them.
+
+    """
+    nulls_high = connection.vendor in NULLS_HIGH_VENDORS
+    lookup = None
+    equal = None
+    for field, value in zip(order_by_fields, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        nulls_after = nulls_high != descending
+        if value is None:
+            term = None if nulls_after else Q(**{'%s__isnull' % (name): False})
+            match = Q(**{'%s__isnull' % (name): True})
+        else:
+            op = 'lt' if descending else 'gt'
+            term = Q(**{'%s__%s' % (name, op): value})
+            if nulls_after:
+                term |= Q(**{'%s__isnull' % (name): True})
+            match = Q(**{name: value})
+        if term is not None:
+            if equal is not None:
+                term = equal & term
+            lookup = term if lookup is None else lookup | term
+        equal = match if equal is None else equal & match
+    return lookup
+
+def with_total(rows):
+    """Add the number of rows in `rows` to each row as `_total`, so a
+    page and the total come back in one query.
+
+    """
+    sql, params = rows.values('id').order_by().query.get_compiler(rows.db).as_sql()
+    return rows.extra(
+        select={'_total': 'SELECT COUNT(*) FROM (%s) _rows' % (sql)},
+        select_params=params,
+    )
 
 from django.views.generic.base import View
+from django.utils.html import escape
+
+class EndpointError(BadRequest):
+    pass
 
 class Endpoint(View):
+    """Aggregate API over one grouping variable.
+
+    (Request) args:
+        fields : comma-separated variables [default: default_fields]
+        degree : degree id [default: PhD]
+        q : only groups whose name contains this term
+        min_resp : minimum number of responses [default: MIN_TABLE_ROWS]
+        <stored var> : only groups with this value
+        <computed var>__gte, <computed var>__lte : value bounds
+        sort : comma-separated variables, prefixed by - to sort descending
+               [default: the grouping variable]
+        limit : page size [default: 100, max: 1000]
+        after : cursor from a previous response's `next`
+        format : json or html [default: json]
+    Returns:
+        Columnar data: one list per requested field, in `columns` order,
+        with the cursor for the next page
+
+    """
+    group_by = None
+    default_fields = (
+        'stipend', 'teaching_num', 'loans', 'part_time_work',
+        'fellowship', 'num_resp',
+    )
+    default_limit = 100
+    max_limit = 1000
 
     def get(self, request):
 
-        #
-        rows = self.get_rows()
+        try:
+            data = self.get_data(request)
+        except (BadRequest, ValueError) as error:
+            return HttpResponseBadRequest(str(error), mimetype='text/plain')
+
+        if request.GET.get('format') == 'html':
+            return HttpResponse(self.to_html(data))
+        return HttpResponse(json.dumps(data), mimetype='application/json')
 
-        #
-        json_data = self.to_json(rows)
+    @classmethod
+    def get_vars(cls, names):
 
-        # Return JSON
-        return HttpResponse(json_data, mimetype='application/json')
+        allowed = [cls.group_by] + [var for var in vars if vars[var].type == 'computed']
+        for name in names:
+            if name not in allowed:
+                raise EndpointError('Unknown field %s' % (name))
+        return names
 
     @classmethod
-    def get_rows(cls):
+    def get_filters(cls, request):
 
-        #
-        annotation_args = {
-            vars[var].name: vars[var].agg for var in vars
-            if vars[var].agg
-        }
+        filters = {}
+        min_resp = int(request.GET.get('min_resp', settings.MIN_TABLE_ROWS))
+        filters['num_resp__gte'] = max(min_resp, settings.MIN_TABLE_ROWS)
 
-        # Get surveys
-        rows = Survey.objects
+        if request.GET.get('q'):
+            filters[vars[cls.group_by].column + '__icontains'] = request.GET['q']
+        if request.GET.get(cls.group_by):
+            filters[vars[cls.group_by].column] = request.GET[cls.group_by]
 
-        # Compute group by
-        rows = rows.values(
-            vars[cls.group_by].name
-        ).annotate(
-            **annotation_args
-        )
+        for param, value in request.GET.items():
+            name, _, op = param.partition('__')
+            if op in ('gte', 'lte') and name in vars and vars[name].type == 'computed':
+                filters['%s__%s' % (vars[name].column, op)] = float(value)
 
-        # Only show rows with minimum number of responses
-        rows = rows.filter(num_resp__gte=settings.MIN_TABLE_ROWS)
+        return filters
 
-        return rows
+    @classmethod
+    def get_rows(cls, request, fields):
+        """Get a page of aggregate rows, and the ordering the cursor
+        follows.
+
+        """
+        # Get precomputed aggregates for activated responses
+        # Only look at PhD students by default
+        degree = get_degree(request, Degree.objects.phd_id())
+        rows = SurveyAggregate.objects.for_grouping([cls.group_by], degree)
+
+        # Filter, including responses below the display minimum
+        rows = rows.filter(**cls.get_filters(request))
+
+        # Order, breaking ties by id so cursors are unambiguous
+        sort = request.GET.get('sort', cls.group_by).split(',')
+        cls.get_vars([name.lstrip('-') for name in sort])
+        order_by_fields = [
+            '%s%s' % ('-' if name.startswith('-') else '',
+                      vars[name.lstrip('-')].column)
+            for name in sort
+        ]
+        order_by_fields.append('id')
+        rows = rows.order_by(*order_by_fields)
+
+        # Apply cursor and limit
+        after = request.GET.get('after')
+        if after:
+            values = decode_cursor(after, len(order_by_fields))
+            rows = rows.filter(keyset_filter(order_by_fields, values))
+        limit = int(request.GET.get('limit', cls.default_limit))
+        limit = max(1, min(limit, cls.max_limit))
+
+        sort_fields = [field.lstrip('-') for field in order_by_fields]
+        columns = aggregate_fields(fields)
+        columns += [field for field in sort_fields if field not in columns]
+        return list(rows.values(*columns)[:limit + 1]), sort_fields, limit
 
     @classmethod
-    def to_data(cls, rows):
+    def get_data(cls, request):
 
-        results = []
+        fields = request.GET.get('fields')
+        fields = fields.split(',') if fields else list(cls.default_fields)
+        fields = cls.get_vars([cls.group_by] + [
+            field for field in fields if field != cls.group_by
+        ])
 
-        for row in rows:
-            result = {
-                var: vars[var].extract(row)
-                for var in vars
-                if vars[var].agg
-            }
-            results.append(result)
+        rows, sort_fields, limit = cls.get_rows(request, fields)
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor([page[-1][field] for field in sort_fields])
 
-        return results
+        return cls.to_data(page, fields, next_cursor)
 
     @classmethod
-    def to_json(cls, data):
+    def to_data(cls, rows, fields, next_cursor=None):
+        """Arrange rows by column.
 
-        # Serialize data to JSON
-        return json.dumps(results)
+        """
+        columns = dict((field, []) for field in fields)
+        for row in rows:
+            row = rename_row(row, fields)
+            for field in fields:
+                columns[field].append(vars[field].extract(row))
+
+        return {
+            'columns': fields,
+            'data': columns,
+            'count': len(rows),
+            'next': next_cursor,
+        }
 
     @classmethod
     def to_html(cls, data):
-
-        pass
+        """Render columnar data as an HTML table.
+
+        """
+        fields = data['columns']
+        html = ['<table class="table table-striped">', '<thead><tr>']
+        html.extend('<th>%s</th>' % escape(field) for field in fields)
+        html.append('</tr></thead><tbody>')
+        for values in zip(*[data['data'][field] for field in fields]):
+            html.append('<tr>%s</tr>' % ''.join(
+                '<td>%s</td>' % escape(value) for value in values
+            ))
+        html.append('</tbody></table>')
+        return '\n'.join(html)
 
 class InstitutionEndpoint(Endpoint):
 
@@ -195,6 +438,7 @@ class DepartmentEndpoint(Endpoint):
 
     group_by = 'department'
 
+@bad_request
 def scatter_json(request):
     """
     """
@@ -204,45 +448,24 @@ def scatter_json(request):
     grouping_variables = request.GET.get('grouping_vars', 'institution')
     grouping_variables = grouping_variables.split(',')
 
-    # Get annotation arguments
-    annotate_args = {
-        vars[xv].name: vars[xv].agg,
-        vars[yv].name: vars[yv].agg,
-    }
-
     #
     columns = [xv, yv] + grouping_variables
 
-    if 'num_resp' not in annotate_args:
-        annotate_args['num_resp'] = vars['num_resp'].agg
+    if 'num_resp' not in (xv, yv):
         columns.append('num_resp')
 
-    # Get surveys
-    rows = Survey.objects
-
-    # Only look at PhD students
-    # TODO: Filter by degree type
-    rows = phds_only(rows)
-    #degrees = Degree.objects
-    #phd_degree = degrees.filter(name__contains='PhD').get()
-    #rows = rows.filter(degree__in=[phd_degree])
-
-    # Only look at activated responses
-    rows = rows.filter(is_active=True)
-
-    # Compute average stipend
-    rows = rows.values(
-        *[vars[g].name for g in grouping_variables]
-    ).annotate(
-        **annotate_args
-    )
+    # Get precomputed aggregates for activated responses
+    # Only look at PhD students by default
+    degree = get_degree(request, Degree.objects.phd_id())
+    rows = SurveyAggregate.objects.for_grouping(grouping_variables, degree)
+    slowlog.set_shape(grouping=grouping_variables, display=sorted([xv, yv]))
 
     # Only show rows with minimum number of responses
     rows = rows.filter(num_resp__gte=settings.MIN_TABLE_ROWS)
 
     # Get results
     results = []
-    for row in rows:
+    for row in aggregate_rows(rows, columns):
         result = {column: vars[column].extract(row)
             for column in columns
             if vars[column].name in row}
@@ -255,6 +478,7 @@ def scatter_json(request):
     # Return JSON
     return HttpResponse(json_data, mimetype='application/json')
 
+@bad_request
 def choro_json(request):
     '''Get data for choropleth.
 
@@ -263,6 +487,7 @@ def choro_json(request):
              'state' or 'county'
         dv : Dependent variable for aggregating data. Examples
              include stipend, teaching, num_resp
+        degree : Degree id [default: PhD]
     Returns:
         HTTPResponse containing JSON data--dictionary mapping
         state / county FIPS codes to aggregated data
@@ -273,38 +498,18 @@ def choro_json(request):
     iv = request.GET.get('iv', 'state')
     dv = request.GET.get('dv', 'stipend')
 
-    # Get annotation params
-    annotate_args = {
-        vars[dv].name: vars[dv].agg,
-    }
-    if 'num_resp' not in annotate_args:
-        annotate_args['num_resp'] = vars['num_resp'].agg
-
-    # Get surveys
-    rows = Survey.objects
-
-    # Only look at PhD students
-    # TODO: Filter by degree type
-    degrees = Degree.objects
-    phd_degree = degrees.filter(name__contains='PhD').get()
-    rows = rows.filter(degree__in=[phd_degree])
-
-    # Only look at activated responses
-    rows = rows.filter(is_active=True)
-
-    # Compute aggregate
-    rows = rows.values(
-        vars[iv].name
-    ).annotate(
-        **annotate_args
-    )
+    # Get precomputed aggregates for activated responses
+    # Only look at PhD students by default
+    degree = get_degree(request, Degree.objects.phd_id())
+    rows = SurveyAggregate.objects.for_grouping([iv], degree)
+    slowlog.set_shape(grouping=[iv], display=[dv])
 
     # Only show rows with minimum number of responses
     rows = rows.filter(num_resp__gte=settings.MIN_CHORO_ROWS)
 
     # Build result dictionary
     result = {}
-    for row in rows:
+    for row in aggregate_rows(rows, [iv, dv]):
         key = vars[iv].extract(row)
         val = vars[dv].extract(row)
         result[key] = val
@@ -315,6 +520,85 @@ def choro_json(request):
     # Return JSON
     return HttpResponse(json_data, mimetype='application/json')
 
+def get_results_vars(request):
+    """Get grouping and display variables from the `grouping_vars` and
+    `display_vars` parameters, adding the response count to the latter.
+
+    """
+    grouping_variables = request.GET.get('grouping_vars', 'institution')
+    grouping_variables = grouping_variables.split(',')
+
+    display_variables = request.GET.get('display_vars', 'salary')
+    display_variables = display_variables.split(',')
+    if not display_variables[0]:
+        display_variables = []
+    display_variables.append('num_resp')
+
+    return grouping_variables, display_variables
+
+def results_rows(grouping_variables, columns, degree, like=''):
+    """Get aggregate rows for a results table: rows for the grouping
+    matching search term `like` in any of the stored `columns`, with
+    at least MIN_TABLE_ROWS responses.
+
+    """
+    rows = SurveyAggregate.objects.for_grouping(grouping_variables, degree)
+
+    # Filter by search term
+    if like:
+        visible_stored_vars = [vars[col] for col in columns if vars[col].type == 'stored']
+        like_lookup = Q(**{visible_stored_vars[0].column + '__icontains': like})
+        for var in visible_stored_vars[1:]:
+            like_lookup = like_lookup | Q(**{var.column + '__icontains': like})
+        rows = rows.filter(like_lookup)
+
+    # Only show rows with minimum number of responses
+    return rows.filter(num_resp__gte=settings.MIN_TABLE_ROWS)
+
+def export_results(grouping_variables, display_variables, degree, like='', format='csv'):
+    """Yield lines of a results table export, ordered by the grouping
+    variables, in one streamed query.
+
+    """
+    columns = grouping_variables + display_variables
+    rows = results_rows(grouping_variables, columns, degree, like)
+    lines, _ = export.EXPORT_FORMATS[format]
+
+    def records():
+        for row in export.stream_values(rows, aggregate_fields(columns)):
+            row = rename_row(row, columns)
+            yield [vars[col].extract(row) for col in columns]
+
+    return lines(columns, records())
+
+@bad_request
+def results_export(request):
+    """Stream the full results table as CSV or NDJSON.
+
+    (Request) args:
+        grouping_vars, display_vars, sSearch, degree : as results_json
+        format : csv or ndjson [default: csv]
+
+    """
+    grouping_variables, display_variables = get_results_vars(request)
+    degree = get_degree(request, Degree.objects.phd_id())
+    like = request.GET.get('sSearch', '')
+    format = request.GET.get('format', 'csv')
+    if format not in export.EXPORT_FORMATS:
+        raise Http404(u'Unknown export format %s' % format)
+    slowlog.set_shape(
+        grouping=grouping_variables, display=sorted(display_variables),
+        search=int(bool(like)),
+    )
+
+    response = HttpResponse(
+        export_results(grouping_variables, display_variables, degree, like, format),
+        mimetype=export.EXPORT_FORMATS[format][1],
+    )
+    response['Content-Disposition'] = 'attachment; filename=results.%s' % format
+    return response
+
+@bad_request
 def results_json(request):
     """Get JSON-formatted data for DataTable.
 
@@ -322,6 +606,9 @@ def results_json(request):
         grouping_vars : comma-separated list of grouping variables
         display_vars : comma-separated list of display variables
         sSearch : search term
+        degree : degree id [default: PhD]
+        after : cursor from a previous response's sNext; returns the
+                rows following it, ignoring iDisplayStart
         ...
     Returns:
         HTTPResponse containing JSON data for request in
@@ -332,32 +619,13 @@ def results_json(request):
     # Get sEcho [datatables security param]
     sEcho = request.GET.get('sEcho', 0)
 
-    # Get search units
-    grouping_variables = request.GET.get('grouping_vars', 'institution')
-    grouping_variables = grouping_variables.split(',')
-
-    # Get display variables
-    display_variables = request.GET.get('display_vars', 'salary')
-    display_variables = display_variables.split(',')
-    if not display_variables[0]:
-        display_variables = []
-    display_variables.append('num_resp')
-
-    # Get annotation arguments
-    annotate_args = {}
-    for dv in display_variables:
-        annotate_args[vars[dv].name] = vars[dv].agg
+    # Get search units and display variables
+    grouping_variables, display_variables = get_results_vars(request)
 
     columns = grouping_variables + display_variables
 
     # Get search term
     like = request.GET.get('sSearch', '')
-    like_lookup = ''
-    if like:
-        visible_stored_vars = [vars[col] for col in columns if vars[col].type == 'stored']
-        like_lookup = Q(**{visible_stored_vars[0].name + '__icontains': like})
-        for var in visible_stored_vars[1:]:
-            like_lookup = like_lookup | Q(**{var.name + '__icontains': like})
 
     # Sorting
     order_by_fields = []
@@ -367,7 +635,7 @@ def results_json(request):
         sort_pos = request.GET.get('iSortCol_%d' % (sort_idx))
         sort_pos = int(sort_pos)
         sort_var = vars[columns[sort_pos]]
-        sort_name = sort_var.name
+        sort_name = sort_var.column
         sort_dir = request.GET.get('sSortDir_%d' % (sort_idx))
         sort_sign = sort_map[sort_dir]
         order_by_fields.append('%s%s' % (sort_sign, sort_name))
@@ -378,44 +646,45 @@ def results_json(request):
     limit = request.GET.get('iDisplayLength', 10)
     limit = min(int(limit), 100)
 
-    # Get surveys
-    rows = Survey.objects
-
-    # Only look at PhD students
-    # TODO: Filter by degree type
-    degrees = Degree.objects
-    phd_degree = degrees.filter(name__contains='PhD').get()
-    rows = rows.filter(degree__in=[phd_degree])
-
-    # Only look at activated responses
-    rows = rows.filter(is_active=True)
-
-    # Filter by search term
-    if like_lookup:
-        rows = rows.filter(like_lookup)
-
-    # Compute average stipend
-    rows = rows.values(
-        *[vars[g].name for g in grouping_variables]
-    ).annotate(
-        **annotate_args
+    # Get precomputed aggregates for activated responses
+    # Only look at PhD students by default
+    degree = get_degree(request, Degree.objects.phd_id())
+    rows = results_rows(grouping_variables, columns, degree, like)
+
+    # Order, breaking ties by id so cursors are unambiguous
+    order_by_fields.append('id')
+    filtered = rows
+    rows = with_total(rows).order_by(*order_by_fields)
+
+    # Apply cursor or offset, and limit
+    after = request.GET.get('after')
+    slowlog.set_shape(
+        grouping=grouping_variables, display=sorted(display_variables),
+        sort=order_by_fields, search=int(bool(like)), cursor=int(bool(after)),
     )
-
-    # Only show rows with minimum number of responses
-    rows = rows.filter(num_resp__gte=settings.MIN_TABLE_ROWS)
-
-    # Order
-    rows = rows.order_by(*order_by_fields)
-
-    # Get total count
-    count_total = rows.count()
-
-    # Apply offset and limit
-    rows = rows[offset:offset + limit]
+    if after:
+        values = decode_cursor(after, len(order_by_fields))
+        # Values that don't fit the sort columns fail in filter()
+        try:
+            rows = rows.filter(keyset_filter(order_by_fields, values))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor', mimetype='text/plain')
+        offset = 0
+    sort_fields = [field.lstrip('-') for field in order_by_fields]
+    fields = aggregate_fields(columns)
+    fields += [field for field in sort_fields if field not in fields]
+    page = list(rows.values('_total', *fields)[offset:offset + limit])
+
+    # Get total count, which needs its own query past the last page
+    if page:
+        count_total = page[0]['_total']
+    else:
+        count_total = filtered.count()
 
     # Get aaData
     aaData = []
-    for row in rows:
+    for row in page:
+        row = rename_row(row, columns)
         aaData.append([
             vars[col].extract(row) for col in columns
             if vars[col].name in row
@@ -427,6 +696,9 @@ def results_json(request):
         'iTotalRecords': count_total,
         'iTotalDisplayRecords': count_total,
         'aaData': aaData,
+        'sNext': encode_cursor(
+            [page[-1][field] for field in sort_fields]
+        ) if page else None,
     }
 
     # Serialize data to JSON
@@ -441,17 +713,9 @@ def channel(request):
 
 def home(request):
 
-    # Get data counts
-    surveys = Survey.objects.filter(is_active=True)
-    context = {
-        'n_resp': surveys.count(),
-        'n_inst': surveys.values('institution').annotate(Count('stipend')).count(),
-        'n_dept': surveys.values('department').annotate(Count('stipend')).count(),
-    }
-
     return render_to_response(
         'home.html',
-        context,
+        home_counts(),
         context_instance=RequestContext(request),
     )
 
@@ -467,15 +731,116 @@ def faq(request):
 
     return render_to_response('faq.html', context_instance=RequestContext(request))
 
-def get_stipends(request):
+@bad_request
+def stipend_histogram(request):
+    """Return a histogram of active stipends as edges and counts.
 
-    # Get stipends from database
-    stipends = Survey.objects.filter(is_active=True).values('stipend')
-    stipends = [stipend['stipend'] for stipend in stipends]
-    stipends_json = json.dumps(stipends)
+    Takes the binning method (`bins`: width, quantile or fd), the number
+    of bins (`n`) and optional degree, institution, state and department
+    filters. Histograms are cached per survey data version.
 
-    # Return JSON
-    return HttpResponse(stipends_json, mimetype='application/json')
+    """
+    method = request.GET.get('bins', 'width')
+    if method not in histogram.BIN_METHODS:
+        method = 'width'
+    try:
+        bins = int(request.GET.get('n', settings.HISTOGRAM_BINS))
+    except ValueError:
+        bins = settings.HISTOGRAM_BINS
+    degree = get_degree(request)
+    filters = dict(
+        (relation_map[group], request.GET[group])
+        for group in relation_map
+        if request.GET.get(group)
+    )
+
+    key = 'stipend_histogram:%s' % (hashlib.sha1(json.dumps(
+        [survey_version(), method, bins, degree, sorted(filters.items())]
+    )).hexdigest())
+    etag = '"%s"' % (key.split(':')[1])
+
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponse(status=304)
+    else:
+        body = cache.get(key)
+        if body is None:
+            surveys = Survey.objects
+            if degree is not None:
+                surveys = surveys.with_degree(degree)
+            surveys = surveys.filter(is_active=True, **filters)
+            data = histogram.histogram(
+                surveys, 'stipend', method, bins,
+                max_bins=settings.HISTOGRAM_MAX_BINS,
+            )
+            data['bins'] = method
+            body = json.dumps(data)
+            cache.set(key, body, settings.HISTOGRAM_CACHE_SECONDS)
+        response = HttpResponse(body, mimetype='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
+
+def lookup_dictionary(request, lookup_name):
+    """Serve the dictionary of an indexed autocomplete lookup.
+
+    Responses carry an ETag tied to the table version and are gzipped
+    when the client accepts it. Requests naming the current version
+    in `v` may be cached indefinitely, since a new version changes
+    the URL.
+
+    """
+    lookup = registry.get(lookup_name)
+    if lookup is None or not hasattr(lookup, 'dictionary'):
+        raise Http404(u'Lookup %s not found' % lookup_name)
+
+    version, body, gzipped = lookup.dictionary()
+    etag = '"%s"' % (version)
+
+    if request.GET.get('v') == version:
+        cache_control = 'public, max-age=31536000'
+    else:
+        cache_control = 'public, max-age=0, must-revalidate'
+
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponse(status=304)
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(gzipped, mimetype='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(body, mimetype='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+def metrics_allowed(request):
+    """Whether a request may read the metrics: it carries the metrics
+    token as a bearer token, or, with no token set, comes from an
+    allowed address.
+
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return constant_time_compare(header, 'Bearer %s' % (token))
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+def metrics(request):
+    """Serve this process's request metrics in the Prometheus text
+    format.
+
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden('Forbidden', mimetype='text/plain')
+
+    response = HttpResponse(
+        request_metrics.render(),
+        mimetype='text/plain; version=0.0.4; charset=utf-8',
+    )
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 def results_figure(request):
 
@@ -499,7 +864,14 @@ def results_scatter(request):
 
 def results_choro(request):
 
-    return render_to_response('choro.html', context_instance=RequestContext(request))
+    # Built map levels, if any (see the build_topojson command)
+    geo_levels = json.dumps(topology.load_manifest())
+
+    return render_to_response(
+        'choro.html',
+        {'geo_levels': geo_levels},
+        context_instance=RequestContext(request),
+    )
 
 def results_table(request):
 
@@ -529,31 +901,10 @@ def activate(request, key):
     # Skip unless key matches hash pattern
     if SHA1_RE.search(key):
 
-        try:
-
-            # Find survey
-            survey = Survey.objects.get(activation_key=key)
-
-            # Delete users w/ same email
-            Survey.objects.filter(
-                email=survey.email
-            ).exclude(
-                activation_key=key
-            ).delete()
-
-            # Activate target survey
-            survey.is_active = True
-            survey.activation_key = 'ACTIVATED'
-            survey.save()
-
-            # Success
+        # Activate survey, removing others with the same email
+        if Survey.objects.activate(key) is not None:
             status = 'success'
 
-        # Couldn't find survey
-        except Survey.DoesNotExist:
-
-            pass
-
     # Return response
     return render_to_response(
         'activation_complete.html',
@@ -7,11 +7,23 @@ from django.utils.safestring import mark_safe
 from django.utils.encoding import force_unicode
 from django.utils.html import escape, conditional_escape
 
+from django.core.urlresolvers import reverse
+
 from selectable.forms import AutoCompleteWidget
 
 
 class FKAutoCompleteWidget(AutoCompleteWidget):
 
+    def build_attrs(self, extra_attrs=None, **kwargs):
+        attrs = super(FKAutoCompleteWidget, self).build_attrs(extra_attrs, **kwargs)
+        if hasattr(self.lookup_class, 'dictionary'):
+            # Versioned URL, so browsers can cache the dictionary until
+            # the table changes
+            version = self.lookup_class.dictionary()[0]
+            url = reverse('lookup_dictionary', args=[self.lookup_class.name()])
+            attrs[u'data-selectable-dictionary'] = '%s?v=%s' % (url, version)
+        return attrs
+
     def render(self, name, value, attrs=None):
         if value is None:
             value = ''
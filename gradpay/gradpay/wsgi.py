@@ -26,3 +26,8 @@ application = get_wsgi_application()
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
+
+# Serve collected static files without going through Django
+from django.conf import settings
+from gradpay.wsgi_static import StaticFiles
+application = StaticFiles(application, settings.STATIC_ROOT, settings.STATIC_URL)
@@ -0,0 +1,143 @@
+'''
+WSGI middleware serving collected static files ahead of Django, so
+asset requests never reach the application.
+'''
+
+import os
+import re
+import mimetypes
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+
+# Names with a 12-digit content hash, as written by the static files
+# storage and the build_topojson command, never change
+HASHED_RE = re.compile(r'\.[0-9a-f]{12}\.')
+
+FOREVER = 'public, max-age=31536000'
+REVALIDATE = 'public, max-age=3600'
+
+BLOCK_SIZE = 64 * 1024
+
+
+class StaticFiles(object):
+    """
+    Serve files under `root` for requests below `prefix`, passing other
+    requests to `application`. Responses use conditional GET (ETag and
+    Last-Modified), the precompressed `.gz` variant of a file for
+    clients that accept gzip, and the server's `wsgi.file_wrapper` so
+    servers like gunicorn can send files with sendfile().
+    """
+
+    def __init__(self, application, root, prefix='/static/'):
+
+        self.application = application
+        self.root = os.path.realpath(root)
+        self.prefix = prefix
+
+    def __call__(self, environ, start_response):
+
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.respond(start_response, '405 Method Not Allowed',
+                                [('Allow', 'GET, HEAD')])
+
+        filename = self.find(path[len(self.prefix):])
+        if filename is None:
+            return self.respond(start_response, '404 Not Found')
+
+        return self.serve(environ, start_response, filename)
+
+    def find(self, name):
+        """ Absolute path of file `name` under the root, or None.
+        Gzipped copies are only served in place of their originals. """
+
+        filename = os.path.realpath(os.path.join(self.root, name))
+        if not filename.startswith(self.root + os.sep):
+            return None
+        if not os.path.isfile(filename):
+            return None
+        if filename.endswith('.gz') and os.path.isfile(filename[:-3]):
+            return None
+        return filename
+
+    def serve(self, environ, start_response, filename):
+
+        content_type, file_encoding = mimetypes.guess_type(filename)
+        if file_encoding:
+            # Compressed files are downloads, not encoded responses
+            content_type = None
+        headers = [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Vary', 'Accept-Encoding'),
+            ('Cache-Control', FOREVER if HASHED_RE.search(filename) else REVALIDATE),
+        ]
+
+        # Prefer the gzipped copy when the client takes it
+        encoding = None
+        if 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '') and \
+                os.path.isfile(filename + '.gz'):
+            filename += '.gz'
+            encoding = 'gzip'
+            headers.append(('Content-Encoding', 'gzip'))
+
+        stat = os.stat(filename)
+        etag = '"%x-%x%s"' % (int(stat.st_mtime), stat.st_size,
+                              '-gz' if encoding else '')
+        headers.append(('ETag', etag))
+        headers.append(('Last-Modified', formatdate(stat.st_mtime, usegmt=True)))
+
+        if self.not_modified(environ, etag, stat.st_mtime):
+            # Only the validators and caching headers, no body headers
+            start_response('304 Not Modified', [
+                header for header in headers
+                if header[0] not in ('Content-Type', 'Content-Encoding')
+            ])
+            return []
+
+        headers.append(('Content-Length', str(stat.st_size)))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+
+        fh = open(filename, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(fh, BLOCK_SIZE)
+        return iter_file(fh)
+
+    def not_modified(self, environ, etag, mtime):
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag in if_none_match or if_none_match.strip() == '*'
+
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            parsed = parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return int(mtime) <= mktime_tz(parsed)
+
+        return False
+
+    def respond(self, start_response, status, headers=None):
+
+        headers = list(headers or [])
+        headers.append(('Content-Type', 'text/plain'))
+        headers.append(('Content-Length', '0'))
+        start_response(status, headers)
+        return []
+
+
+def iter_file(fh):
+
+    try:
+        while True:
+            block = fh.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+    finally:
+        fh.close()